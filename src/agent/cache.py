@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+import numpy as np
+import ujson as json
+
+logger = logging.getLogger("uvicorn.error")
+
+# role marker the dialogue manager puts in front of every user message
+HUMAN_TURN = "HUMAN :"
+
+
+def normalize_prompt(prompt: str) -> str:
+    # prompts that only differ in whitespace get the same reply
+    return " ".join(prompt.split())
+
+
+def split_turn(prompt: str) -> tuple[str, str]:
+    # (everything before the newest HUMAN turn, the newest HUMAN turn) of a normalized prompt
+    index = prompt.rfind(HUMAN_TURN)
+    if index < 0:
+        return prompt, ""
+    return prompt[:index], prompt[index + len(HUMAN_TURN):].strip()
+
+
+class CacheLookup:
+    def __init__(self, key: str, scope: str, text: str | None = None, vector=None):
+        self.key = key
+        # semantic matches are only looked for among entries of the same scope
+        self.scope = scope
+        self.text = text
+        # embedding of the newest HUMAN turn, kept so that storing the reply does not embed it again
+        self.vector = vector
+
+
+class ResponseCache:
+    # replies to repeated prompts, in two tiers:
+    # - exact: keyed by a hash of the normalized prompt and the generation params
+    # - semantic (optional): nearest neighbour over embeddings of the newest HUMAN turn, among entries
+    #   with the same params and the same conversation before that turn, accepted above a cosine
+    #   similarity threshold. the shared initial prompt would dominate an embedding of the whole
+    #   prompt and match unrelated messages, and a reply never crosses into another conversation.
+    # both tiers share one LRU order, size bound and TTL.
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        max_temperature: float,
+        embed: Callable | None = None,
+        similarity: float = 0.97,
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_temperature = max_temperature
+        self.embed = embed
+        self.similarity = similarity
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self.embed_errors = 0
+        # key -> (text, scope, expires_at)
+        self._entries = OrderedDict()
+        self._vector_keys = []
+        self._vectors = None
+        self._embed_lock = threading.Lock()
+
+    def cacheable(self, params: dict, enabled: bool = True) -> bool:
+        # replies sampled hotter than max_temperature are meant to differ between calls
+        if not enabled or self.max_size <= 0 or params.get("temperature", 0.0) > self.max_temperature:
+            self.bypassed += 1
+            return False
+        return True
+
+    async def lookup(self, prompt: str, params: dict) -> CacheLookup:
+        params_key = json.dumps(params, sort_keys=True)
+        normalized = normalize_prompt(prompt)
+        context, turn = split_turn(normalized)
+        key = hashlib.sha256(f"{params_key}\n{normalized}".encode("utf-8")).hexdigest()
+        scope = hashlib.sha256(f"{params_key}\n{context}".encode("utf-8")).hexdigest()
+        lookup = CacheLookup(key=key, scope=scope)
+
+        entry = self._live(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            lookup.text = entry[0]
+            return lookup
+
+        if self.embed is not None and turn:
+            try:
+                lookup.vector = await asyncio.to_thread(self._embed, turn)
+            except Exception:
+                # the semantic tier is an optimization, the reply is generated as usual
+                logger.exception("Embedding the prompt for the response cache failed")
+                self.embed_errors += 1
+            match = self._nearest(lookup.vector, scope) if lookup.vector is not None else None
+            if match is not None:
+                self._entries.move_to_end(match)
+                self.semantic_hits += 1
+                lookup.text = self._entries[match][0]
+                return lookup
+
+        self.misses += 1
+        return lookup
+
+    def store(self, lookup: CacheLookup, text: str):
+        self._entries[lookup.key] = (text, lookup.scope, time.monotonic() + self.ttl)
+        self._entries.move_to_end(lookup.key)
+        if lookup.vector is not None and lookup.key not in self._vector_keys:
+            self._vector_keys.append(lookup.key)
+            row = lookup.vector[np.newaxis, :]
+            self._vectors = row if self._vectors is None else np.vstack([self._vectors, row])
+        while len(self._entries) > self.max_size:
+            key, _ = self._entries.popitem(last=False)
+            self._drop_vector(key)
+            self.evictions += 1
+
+    def _embed(self, text: str) -> np.ndarray:
+        # llama contexts are not thread safe, one embedding at a time
+        with self._embed_lock:
+            vector = np.asarray(self.embed(text), dtype=np.float32)
+        if vector.ndim == 2:
+            # per token embeddings, pooled into one vector for the text
+            vector = vector.mean(axis=0)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _nearest(self, vector: np.ndarray, scope: str) -> str | None:
+        if self._vectors is None or len(self._vector_keys) == 0:
+            return None
+        similarities = self._vectors @ vector
+        for index in np.argsort(-similarities):
+            if similarities[index] < self.similarity:
+                return None
+            key = self._vector_keys[index]
+            _, entry_scope, expires_at = self._entries[key]
+            if entry_scope == scope and expires_at > time.monotonic():
+                return key
+        return None
+
+    def _drop_vector(self, key: str):
+        if key not in self._vector_keys:
+            return
+        index = self._vector_keys.index(key)
+        del self._vector_keys[index]
+        self._vectors = np.delete(self._vectors, index, axis=0)
+
+    def _live(self, key: str) -> tuple | None:
+        # expired entries are dropped when they are found, the size bound takes care of the rest
+        entry = self._entries.get(key)
+        if entry is not None and entry[2] <= time.monotonic():
+            del self._entries[key]
+            self._drop_vector(key)
+            self.evictions += 1
+            return None
+        return entry
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "semantic": self.embed is not None,
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "embed_errors": self.embed_errors,
+        }
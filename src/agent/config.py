@@ -1,4 +1,39 @@
 import os
 
 MODEL_PATH = os.getenv("MODEL_PATH", "/app/model.bin")
-MAX_TOKENS = int(os.getenv("MAX_TOKENS", 100))
\ No newline at end of file
+MAX_TOKENS = int(os.getenv("MAX_TOKENS", 100))
+TEMPERATURE = float(os.getenv("TEMPERATURE", 0.8))
+N_CTX = int(os.getenv("N_CTX", 512))
+# mmap lets replicas share the weights and start without reading the whole file,
+# mlock keeps them resident so the first requests do not pay for page faults
+USE_MMAP = os.getenv("USE_MMAP", "true").lower() == "true"
+USE_MLOCK = os.getenv("USE_MLOCK", "false").lower() == "true"
+# evaluated once per replica before the agent reports ready, keep it equal to the dialogue manager's INITIAL_PROMPT
+WARMUP = os.getenv("WARMUP", "true").lower() == "true"
+WARMUP_PROMPT = os.getenv(
+    "WARMUP_PROMPT",
+    "As a helpful IFS therapist chatbot, your role is to guide users through a simulated IFS session in a safe and supportive manner with a few changes to the exact steps of the IFS model.",
+)
+# llama state cache reused across requests sharing a prompt prefix: "ram", "disk" or "none"
+PROMPT_CACHE = os.getenv("PROMPT_CACHE", "ram")
+PROMPT_CACHE_CAPACITY = int(os.getenv("PROMPT_CACHE_CAPACITY", 2 << 30))  # bytes
+PROMPT_CACHE_DIR = os.getenv("PROMPT_CACHE_DIR", "/app/prompt_cache")
+# inference queue: requests waiting beyond QUEUE_MAX_DEPTH are rejected with 503 and Retry-After
+QUEUE_MAX_DEPTH = int(os.getenv("QUEUE_MAX_DEPTH", 16))
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", 120))  # seconds, queueing included
+RETRY_AFTER = int(os.getenv("RETRY_AFTER", 5))  # seconds
+# number of model replicas, each in its own process pinned to a slice of the cores when PIN_WORKERS is set
+WORKERS = int(os.getenv("WORKERS", 1))
+N_THREADS = int(os.getenv("N_THREADS", 0)) or None  # per replica, defaults to the cores of its slice
+PIN_WORKERS = os.getenv("PIN_WORKERS", "true").lower() == "true"
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 256))
+
+# replies to repeated prompts. generations sampled above RESPONSE_CACHE_MAX_TEMPERATURE are never cached,
+# the default 0 only caches greedy decoding, raise it to TEMPERATURE to cache sampled replies as well.
+# the semantic tier also matches prompts whose embeddings are within RESPONSE_CACHE_SIMILARITY
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 1024))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 3600))  # seconds
+RESPONSE_CACHE_MAX_TEMPERATURE = float(os.getenv("RESPONSE_CACHE_MAX_TEMPERATURE", 0))
+RESPONSE_CACHE_SEMANTIC = os.getenv("RESPONSE_CACHE_SEMANTIC", "false").lower() == "true"
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", 0.97))
+EMBEDDING_MODEL_PATH = os.getenv("EMBEDDING_MODEL_PATH", MODEL_PATH)
\ No newline at end of file
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import time
+from config import (
+    QUEUE_MAX_DEPTH,
+    WORKERS,
+    N_THREADS,
+    PIN_WORKERS,
+    TEMPERATURE,
+    RESPONSE_CACHE_SEMANTIC,
+    WARMUP,
+    WARMUP_PROMPT,
+)
+from cache import ResponseCache
+from model import load_model, load_embedder, load_tokenizer, stream_completion
+from pool import create_replicas
+from scheduler import InferenceJob, InferenceScheduler
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class AgentRuntime:
+    # owns everything that takes time to come up: models, replicas and the scheduler.
+    # loading runs in the background so that /healthz answers while the model loads,
+    # and /readyz only reports ready once the warmup pass has finished.
+    def __init__(self, response_cache: ResponseCache):
+        self.response_cache = response_cache
+        self.llm = None
+        self.embedder = None
+        self.replicas = []
+        self.scheduler = None
+        self.ready = False
+        self.error = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.llm.tokenize(text.encode("utf-8"), add_bos=False))
+
+    def generate(self, job: InferenceJob, emit) -> str:
+        # in-process runner, used on the scheduler's worker thread when there is a single replica
+        text = []
+        for token in stream_completion(
+            self.llm, job.prompt, job.max_tokens, job.stop, job.temperature, job.cancelled
+        ):
+            text.append(token)
+            emit(token)
+        return "".join(text)
+
+    async def start(self):
+        try:
+            await self._load()
+            if WARMUP:
+                await self._warmup()
+            self.ready = True
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            logger.exception("Agent failed to start")
+
+    async def _load(self):
+        started = time.monotonic()
+        if WORKERS > 1:
+            # worker pool mode: every replica is a separate process, this one only tokenizes.
+            # replicas load their models in parallel.
+            self.replicas = create_replicas(workers=WORKERS, n_threads=N_THREADS, pin=PIN_WORKERS)
+            for replica in self.replicas:
+                replica.start()
+            self.llm = await asyncio.to_thread(load_tokenizer)
+            await asyncio.gather(*[asyncio.to_thread(replica.wait_ready) for replica in self.replicas])
+            runners = [replica.generate for replica in self.replicas]
+        else:
+            self.llm = await asyncio.to_thread(load_model, N_THREADS)
+            runners = [self.generate]
+
+        if RESPONSE_CACHE_SEMANTIC:
+            self.embedder = await asyncio.to_thread(load_embedder, N_THREADS)
+            self.response_cache.embed = self.embedder.embed
+
+        self.scheduler = InferenceScheduler(runners=runners, max_depth=QUEUE_MAX_DEPTH, count_tokens=self.count_tokens)
+        await self.scheduler.start()
+        self.load_seconds = time.monotonic() - started
+        logger.info("Loaded %d model replica(s) in %.2f seconds", len(runners), self.load_seconds)
+
+    async def _warmup(self):
+        # one short generation per worker evaluates the warmup prompt, faults the mmapped weights in
+        # and leaves the evaluated prompt in each replica's prompt cache for the first real requests
+        started = time.monotonic()
+        jobs = [
+            InferenceJob(prompt=WARMUP_PROMPT, max_tokens=1, stop=[], temperature=TEMPERATURE)
+            for _ in range(self.scheduler.workers)
+        ]
+        for job in jobs:
+            await self.scheduler.enqueue(job)
+        await asyncio.gather(*[job.future for job in jobs])
+        self.warmup_seconds = time.monotonic() - started
+        logger.info("Warmed up in %.2f seconds", self.warmup_seconds)
+
+    async def stop(self):
+        if self.scheduler is not None:
+            await self.scheduler.stop()
+        for replica in self.replicas:
+            replica.stop()
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "workers": len(self.replicas) or (1 if self.llm is not None else 0),
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+        }
@@ -1,23 +1,250 @@
-from llama_cpp import Llama
-from config import MODEL_PATH, MAX_TOKENS
-from fastapi import FastAPI, Request
+import asyncio
+import time
+import ujson as json
+from config import (
+    MAX_TOKENS,
+    REQUEST_TIMEOUT,
+    RETRY_AFTER,
+    BATCH_MAX_ITEMS,
+    TEMPERATURE,
+    RESPONSE_CACHE_SIZE,
+    RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_MAX_TEMPERATURE,
+    RESPONSE_CACHE_SIMILARITY,
+)
+from fastapi import FastAPI, Request, HTTPException, Header, status
+from fastapi.responses import StreamingResponse, Response, JSONResponse
+from schema import (
+    TokenizeRequest,
+    TokenizeResponse,
+    BatchRequest,
+    BatchResponse,
+    BatchItemResult,
+)
+from cache import ResponseCache
+from lifecycle import AgentRuntime
+from metrics import RequestMetricsMiddleware, register_stats, metrics_response
+from scheduler import (
+    InferenceJob,
+    QueueFullError,
+    InferenceTimeoutError,
+    ClientDisconnectedError,
+)
 
-# Load the model
-llm = Llama(model_path=MODEL_PATH)
+STOP = ["\n", "\n\n", " Q:", "HUMAN:"]
+
+# params every interactive generation runs with, part of the response cache key
+GENERATION_PARAMS = {"max_tokens": MAX_TOKENS, "stop": STOP, "temperature": TEMPERATURE}
+
+response_cache = ResponseCache(
+    max_size=RESPONSE_CACHE_SIZE,
+    ttl=RESPONSE_CACHE_TTL,
+    max_temperature=RESPONSE_CACHE_MAX_TEMPERATURE,
+    similarity=RESPONSE_CACHE_SIMILARITY,
+)
+runtime = AgentRuntime(response_cache=response_cache)
 
 app = FastAPI()
+app.add_middleware(RequestMetricsMiddleware)
+
+register_stats("agent_queue", lambda: runtime.scheduler.stats() if runtime.scheduler is not None else {}, "Inference queue")
+register_stats("agent_cache", response_cache.stats, "Response cache")
+register_stats("agent_runtime", runtime.status, "Model runtime")
+
+
+@app.on_event("startup")
+async def start_runtime():
+    # models load in the background, requests are served once runtime.ready is set
+    app.state.loading = asyncio.create_task(runtime.start())
+
+
+@app.on_event("shutdown")
+async def stop_runtime():
+    app.state.loading.cancel()
+    await runtime.stop()
+
+
+@app.get("/healthz")
+async def healthz():
+    # liveness: the process is up and its event loop is answering. a runtime that failed to start
+    # never recovers on its own, so the process is reported dead and gets restarted
+    if runtime.error is not None:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=runtime.status())
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    # readiness: models are loaded and warmed up, traffic can be routed here
+    if not runtime.ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=runtime.status())
+    return runtime.status()
+
+
+def ensure_ready():
+    if not runtime.ready:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Agent is starting" if runtime.error is None else f"Agent failed to start: {runtime.error}",
+            headers={"Retry-After": str(RETRY_AFTER)},
+        )
+
+
+def submit(prompt: str, stream: bool = False) -> InferenceJob:
+    ensure_ready()
+    job = InferenceJob(prompt=prompt, max_tokens=MAX_TOKENS, stop=STOP, temperature=TEMPERATURE, stream=stream)
+    try:
+        runtime.scheduler.submit(job)
+    except QueueFullError as e:
+        # fail fast instead of piling requests up behind a busy model
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": str(RETRY_AFTER)},
+        )
+    return job
+
 
 @app.get("/api/v1/agent")
-async def llama(request: Request, prompt:str):
-    stream = llm(
-        f"""{prompt}""",
-        max_tokens=MAX_TOKENS,
-        stop=["\n", "\n\n", " Q:", "HUMAN:"],
-        stream=False,
-    )
-    if len(stream["choices"]) > 0: 
-        message = stream["choices"][0]["text"]
+async def llama(request: Request, prompt:str, cache: bool = True):
+    lookup = None
+    if response_cache.cacheable(GENERATION_PARAMS, enabled=cache):
+        lookup = await response_cache.lookup(prompt, GENERATION_PARAMS)
+        if lookup.text is not None:
+            return lookup.text
 
-        return message
-    else:
+    job = submit(prompt)
+    try:
+        text = await runtime.scheduler.wait(job, timeout=REQUEST_TIMEOUT, is_disconnected=request.is_disconnected)
+        if lookup is not None:
+            response_cache.store(lookup, text)
+        return text
+    except InferenceTimeoutError as e:
+        raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=str(e))
+    except ClientDisconnectedError:
+        # nobody is left to read the response
         return {}
+
+
+@app.get("/api/v1/agent/stream")
+async def llama_stream(prompt: str, cache: bool = True):
+    # same generation as /api/v1/agent, sent as one NDJSON line per token while it is generated
+    lookup = None
+    if response_cache.cacheable(GENERATION_PARAMS, enabled=cache):
+        lookup = await response_cache.lookup(prompt, GENERATION_PARAMS)
+        if lookup.text is not None:
+            # a cached reply is sent as a single token
+            cached = json.dumps({"token": lookup.text}) + "\n"
+            return StreamingResponse(iter([cached]), media_type="application/x-ndjson")
+
+    job = submit(prompt, stream=True)
+
+    async def relay():
+        # closing this generator (client disconnect) or running out of time cancels the job
+        deadline = job.enqueued_at + REQUEST_TIMEOUT
+        try:
+            while True:
+                try:
+                    token = await asyncio.wait_for(job.tokens.get(), timeout=deadline - time.monotonic())
+                except asyncio.TimeoutError:
+                    runtime.scheduler.timed_out += 1
+                    yield json.dumps({"error": f"Inference did not finish within {REQUEST_TIMEOUT} seconds"}) + "\n"
+                    return
+                if token is None:
+                    break
+                yield json.dumps({"token": token}) + "\n"
+            if job.future.done() and job.future.exception() is not None:
+                yield json.dumps({"error": str(job.future.exception())}) + "\n"
+            elif job.future.done() and lookup is not None and not job.cancelled.is_set():
+                response_cache.store(lookup, job.future.result())
+        finally:
+            job.cancel()
+
+    return StreamingResponse(relay(), media_type="application/x-ndjson")
+
+
+@app.post("/api/v1/agent/batch", response_model=BatchResponse)
+async def llama_batch(request: Request, data: BatchRequest):
+    # many prompts in one round-trip. items are fed to the scheduler at most one per worker at a time,
+    # so a batch keeps every replica busy without filling the queue for interactive requests.
+    # there is no batched decoding, a batch saves round trips and its throughput scales with WORKERS.
+    ensure_ready()
+    if len(data.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"A batch can have at most {BATCH_MAX_ITEMS} items",
+        )
+    in_flight = asyncio.Semaphore(runtime.scheduler.workers)
+
+    async def run(item) -> BatchItemResult:
+        prompt_tokens = await count_tokens(item.prompt)
+        async with in_flight:
+            job = InferenceJob(
+                prompt=item.prompt,
+                max_tokens=item.max_tokens or MAX_TOKENS,
+                stop=item.stop if item.stop is not None else STOP,
+                temperature=TEMPERATURE,
+            )
+            await runtime.scheduler.enqueue(job)
+            try:
+                text = await runtime.scheduler.wait(job, timeout=REQUEST_TIMEOUT, is_disconnected=request.is_disconnected)
+            except ClientDisconnectedError:
+                raise
+            except Exception as e:
+                return BatchItemResult(error=str(e), prompt_tokens=prompt_tokens)
+        seconds = time.monotonic() - job.started_at
+        # counted by the worker while it generated
+        completion_tokens = job.completion_tokens
+        return BatchItemResult(
+            text=text,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            seconds=seconds,
+            tokens_per_second=completion_tokens / seconds if seconds > 0 else 0.0,
+        )
+
+    started = time.monotonic()
+    try:
+        items = await asyncio.gather(*[run(item) for item in data.items])
+    except ClientDisconnectedError:
+        # nobody is left to read the response
+        return Response(status_code=status.HTTP_204_NO_CONTENT)
+    seconds = time.monotonic() - started
+    completion_tokens = sum(item.completion_tokens for item in items)
+    return BatchResponse(
+        items=items,
+        prompt_tokens=sum(item.prompt_tokens for item in items),
+        completion_tokens=completion_tokens,
+        seconds=seconds,
+        tokens_per_second=completion_tokens / seconds if seconds > 0 else 0.0,
+    )
+
+
+@app.get("/api/v1/agent/queue")
+async def queue_stats():
+    ensure_ready()
+    return runtime.scheduler.stats()
+
+
+@app.get("/api/v1/agent/cache")
+async def cache_stats():
+    return response_cache.stats()
+
+
+async def count_tokens(text: str) -> int:
+    # tokenizing long texts takes a while, it runs off the event loop
+    return await asyncio.to_thread(runtime.count_tokens, text)
+
+
+@app.post("/api/v1/agent/tokenize", response_model=TokenizeResponse)
+async def tokenize(data: TokenizeRequest):
+    # token counts as the model sees them, used by the dialogue manager to budget the prompt
+    ensure_ready()
+    counts = await asyncio.to_thread(lambda: [runtime.count_tokens(text) for text in data.texts])
+    return {"counts": counts}
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(accept: str = Header(None)):
+    # prometheus scrape endpoint: queue wait, time to first token, token counts and throughput
+    return metrics_response(accept)
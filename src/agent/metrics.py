@@ -0,0 +1,30 @@
+from prometheus_client import Histogram
+from common.metrics import (
+    REQUEST_ID_HEADER,
+    REQUEST_SECONDS,
+    RequestMetricsMiddleware,
+    metrics_response,
+    observe,
+    register_stats,
+    request_id,
+)
+
+TOKEN_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+QUEUE_WAIT_SECONDS = Histogram("agent_queue_wait_seconds", "Time a generation waited in the queue for a worker")
+FIRST_TOKEN_SECONDS = Histogram(
+    "agent_time_to_first_token_seconds",
+    "Time from enqueueing a generation to its first token",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128),
+)
+GENERATION_SECONDS = Histogram(
+    "agent_generation_seconds",
+    "Time a worker spent on one generation",
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128),
+)
+TOKENS_PER_SECOND = Histogram(
+    "agent_tokens_per_second",
+    "Completion tokens per second of generation time",
+    buckets=(1, 2, 4, 6, 8, 12, 16, 24, 32, 48, 64, 128),
+)
+PROMPT_TOKENS = Histogram("agent_prompt_tokens", "Prompt tokens per generation", buckets=TOKEN_BUCKETS)
+COMPLETION_TOKENS = Histogram("agent_completion_tokens", "Completion tokens per generation", buckets=TOKEN_BUCKETS)
@@ -0,0 +1,61 @@
+from typing import Iterator
+from llama_cpp import Llama, LlamaRAMCache, LlamaDiskCache
+from config import (
+    MODEL_PATH,
+    N_CTX,
+    USE_MMAP,
+    USE_MLOCK,
+    EMBEDDING_MODEL_PATH,
+    PROMPT_CACHE,
+    PROMPT_CACHE_CAPACITY,
+    PROMPT_CACHE_DIR,
+)
+
+
+def create_prompt_cache():
+    # llama states are stored after every completion and looked up by longest token prefix,
+    # so a continued dialogue only evaluates the tokens appended since its previous turn
+    # and every new dialogue reuses the evaluated initial prompt.
+    if PROMPT_CACHE == "ram":
+        return LlamaRAMCache(capacity_bytes=PROMPT_CACHE_CAPACITY)
+    if PROMPT_CACHE == "disk":
+        return LlamaDiskCache(cache_dir=PROMPT_CACHE_DIR, capacity_bytes=PROMPT_CACHE_CAPACITY)
+    return None
+
+
+def load_model(n_threads: int = None) -> Llama:
+    # with mmap every replica on the host shares one copy of the weights through the page cache
+    llm = Llama(model_path=MODEL_PATH, n_ctx=N_CTX, n_threads=n_threads, use_mmap=USE_MMAP, use_mlock=USE_MLOCK)
+    prompt_cache = create_prompt_cache()
+    if prompt_cache is not None:
+        llm.set_cache(prompt_cache)
+    return llm
+
+
+def load_embedder(n_threads: int = None) -> Llama:
+    # a separate context in embedding mode, used by the semantic tier of the response cache
+    return Llama(
+        model_path=EMBEDDING_MODEL_PATH,
+        n_ctx=N_CTX,
+        n_threads=n_threads,
+        embedding=True,
+        use_mmap=USE_MMAP,
+        use_mlock=USE_MLOCK,
+    )
+
+
+def load_tokenizer() -> Llama:
+    # vocabulary only, for processes that count tokens but never generate
+    return Llama(model_path=MODEL_PATH, vocab_only=True)
+
+
+def stream_completion(
+    llm: Llama, prompt: str, max_tokens: int, stop: list, temperature: float, cancelled
+) -> Iterator[str]:
+    # generation is always streamed internally so that a cancelled request
+    # stops at the next token instead of running to max_tokens
+    for chunk in llm(prompt, max_tokens=max_tokens, stop=stop, temperature=temperature, stream=True):
+        if cancelled.is_set():
+            break
+        if len(chunk["choices"]) > 0 and chunk["choices"][0]["text"]:
+            yield chunk["choices"][0]["text"]
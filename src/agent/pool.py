@@ -0,0 +1,102 @@
+import multiprocessing
+import os
+from scheduler import InferenceJob
+
+
+def core_slices(workers: int) -> list:
+    # splits the cores this process may run on into one contiguous slice per worker
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+    size = max(len(cores) // workers, 1)
+    return [cores[i * size:(i + 1) * size] or cores for i in range(workers)]
+
+
+def replica_main(conn, cancel, cores: list, n_threads: int):
+    # entry point of a replica process: load the model once, then serve one job at a time
+    if len(cores) > 0 and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    from model import load_model, stream_completion
+
+    llm = load_model(n_threads=n_threads)
+    conn.send(("ready", None))
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        prompt, max_tokens, stop, temperature = request
+        cancel.clear()
+        try:
+            text = []
+            for token in stream_completion(llm, prompt, max_tokens, stop, temperature, cancel):
+                text.append(token)
+                conn.send(("token", token))
+            conn.send(("done", "".join(text)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class ReplicaError(Exception):
+    pass
+
+
+class ModelReplica:
+    # a model loaded in its own process and pinned to a slice of the cores.
+    # generate() is called from a scheduler worker thread and blocks until the job is done.
+    def __init__(self, index: int, cores: list, n_threads: int):
+        context = multiprocessing.get_context("spawn")
+        self.index = index
+        self.cores = cores
+        self.n_threads = n_threads
+        self.cancel = context.Event()
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=replica_main,
+            args=(child_conn, self.cancel, cores, self.n_threads),
+            name=f"model-replica-{index}",
+            daemon=True,
+        )
+
+    def start(self):
+        self.process.start()
+
+    def wait_ready(self):
+        try:
+            kind, _ = self.conn.recv()
+        except EOFError:
+            kind = None
+        if kind != "ready":
+            raise ReplicaError(f"Replica {self.index} failed to start")
+
+    def stop(self):
+        if self.process.is_alive():
+            self.conn.send(None)
+            self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+    def generate(self, job: InferenceJob, emit, poll_interval: float = 0.1) -> str:
+        if not self.process.is_alive():
+            raise ReplicaError(f"Replica {self.index} is not running")
+        self.conn.send((job.prompt, job.max_tokens, job.stop, job.temperature))
+        while True:
+            if job.cancelled.is_set():
+                self.cancel.set()
+            if not self.conn.poll(poll_interval):
+                if not self.process.is_alive():
+                    raise ReplicaError(f"Replica {self.index} exited during generation")
+                continue
+            kind, value = self.conn.recv()
+            if kind == "token":
+                emit(value)
+            elif kind == "done":
+                return value
+            else:
+                raise ReplicaError(value)
+
+
+def create_replicas(workers: int, n_threads: int = None, pin: bool = True) -> list:
+    # without an explicit n_threads every replica gets as many threads as cores in its slice
+    return [
+        ModelReplica(index=i, cores=cores if pin else [], n_threads=n_threads or len(cores))
+        for i, cores in enumerate(core_slices(workers))
+    ]
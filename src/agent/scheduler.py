@@ -0,0 +1,181 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from metrics import (
+    request_id,
+    observe,
+    QUEUE_WAIT_SECONDS,
+    FIRST_TOKEN_SECONDS,
+    GENERATION_SECONDS,
+    TOKENS_PER_SECOND,
+    PROMPT_TOKENS,
+    COMPLETION_TOKENS,
+)
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class InferenceTimeoutError(Exception):
+    pass
+
+
+class ClientDisconnectedError(Exception):
+    pass
+
+
+class InferenceJob:
+    def __init__(self, prompt: str, max_tokens: int, stop: list, temperature: float, stream: bool = False):
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.stop = stop
+        self.temperature = temperature
+        # checked by the generation loop between tokens, so a cancelled job stops early
+        self.cancelled = threading.Event()
+        self.future = asyncio.get_running_loop().create_future()
+        # generated tokens followed by None, only for streaming jobs
+        self.tokens = asyncio.Queue() if stream else None
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.first_token_at = None
+        self.completion_tokens = 0
+        # the request the job was queued by, its metrics are recorded on a worker
+        self.request_id = request_id.get()
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+class InferenceScheduler:
+    # a bounded queue in front of the model. generation runs on dedicated worker threads,
+    # one job per worker at a time, so the event loop stays free for every other request.
+    # idle workers take the next job from the shared queue.
+    def __init__(self, runners: list, max_depth: int, count_tokens: Callable = None):
+        # each runner(job, emit) runs a job to completion on its own worker thread, calling
+        # emit(token) for every generated token and returning the generated text.
+        # count_tokens(text), when given, counts prompt tokens for the metrics once a job is done
+        self.runners = runners
+        self.count_tokens = count_tokens
+        self.max_depth = max_depth
+        self.workers = len(runners)
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.timed_out = 0
+        self.total_wait = 0.0
+        self.last_wait = 0.0
+        self._queue = None
+        self._tasks = []
+        self._executor = None
+
+    async def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_depth)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="inference")
+        self._tasks = [asyncio.create_task(self._worker(runner)) for runner in self.runners]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, job: InferenceJob):
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise QueueFullError(f"Inference queue is full ({self.max_depth} requests waiting)")
+
+    async def enqueue(self, job: InferenceJob):
+        # waits for room in the queue instead of failing, for batch work that may take its time
+        await self._queue.put(job)
+        job.enqueued_at = time.monotonic()
+
+    async def wait(self, job: InferenceJob, timeout: float, is_disconnected: Callable, poll_interval: float = 0.5) -> str:
+        # waits for a non streaming job while watching for its deadline and for the client going away
+        deadline = job.enqueued_at + timeout
+        while True:
+            done, _ = await asyncio.wait({job.future}, timeout=poll_interval)
+            if done:
+                return job.future.result()
+            if await is_disconnected():
+                job.cancel()
+                self.cancelled += 1
+                raise ClientDisconnectedError()
+            if time.monotonic() > deadline:
+                job.cancel()
+                self.timed_out += 1
+                raise InferenceTimeoutError(f"Inference did not finish within {timeout} seconds")
+
+    async def _worker(self, runner: Callable):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            if job.cancelled.is_set():
+                continue
+
+            job.started_at = time.monotonic()
+            self.last_wait = job.started_at - job.enqueued_at
+            self.total_wait += self.last_wait
+            self.running += 1
+            observe(QUEUE_WAIT_SECONDS, self.last_wait, job.request_id)
+
+            def emit(token: str, job=job):
+                # streamed chunks are single tokens
+                if job.first_token_at is None:
+                    job.first_token_at = time.monotonic()
+                job.completion_tokens += 1
+                if job.tokens is not None:
+                    loop.call_soon_threadsafe(job.tokens.put_nowait, token)
+
+            try:
+                text = await loop.run_in_executor(self._executor, runner, job, emit)
+                self.completed += 1
+                if not job.future.done():
+                    job.future.set_result(text)
+                await self._record(job, loop)
+            except Exception as e:
+                self.failed += 1
+                if not job.future.done() and not job.cancelled.is_set():
+                    job.future.set_exception(e)
+            finally:
+                self.running -= 1
+                if job.tokens is not None:
+                    job.tokens.put_nowait(None)
+
+    async def _record(self, job: InferenceJob, loop):
+        # the reply is already handed out, recording only delays this worker's next job
+        seconds = time.monotonic() - job.started_at
+        observe(GENERATION_SECONDS, seconds, job.request_id)
+        observe(COMPLETION_TOKENS, job.completion_tokens, job.request_id)
+        if seconds > 0:
+            observe(TOKENS_PER_SECOND, job.completion_tokens / seconds, job.request_id)
+        if job.first_token_at is not None:
+            observe(FIRST_TOKEN_SECONDS, job.first_token_at - job.enqueued_at, job.request_id)
+        if self.count_tokens is not None:
+            try:
+                prompt_tokens = await loop.run_in_executor(self._executor, self.count_tokens, job.prompt)
+            except Exception:
+                return
+            observe(PROMPT_TOKENS, prompt_tokens, job.request_id)
+
+    def stats(self) -> dict:
+        started = self.completed + self.failed + self.running
+        return {
+            "depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_depth": self.max_depth,
+            "workers": self.workers,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+            "timed_out": self.timed_out,
+            "last_wait_seconds": self.last_wait,
+            "average_wait_seconds": self.total_wait / started if started > 0 else 0.0,
+        }
@@ -0,0 +1,36 @@
+from pydantic import BaseModel, Field
+
+
+class TokenizeRequest(BaseModel):
+    texts: list[str] = Field(..., description="texts to count tokens for")
+
+
+class TokenizeResponse(BaseModel):
+    counts: list[int]
+
+
+class BatchItem(BaseModel):
+    prompt: str
+    max_tokens: int | None = Field(None, gt=0, description="defaults to the agent's MAX_TOKENS")
+    stop: list[str] | None = Field(None, description="defaults to the agent's stop sequences")
+
+
+class BatchRequest(BaseModel):
+    items: list[BatchItem] = Field(..., min_length=1)
+
+
+class BatchItemResult(BaseModel):
+    text: str | None = None
+    error: str | None = None
+    prompt_tokens: int
+    completion_tokens: int = 0
+    seconds: float = 0.0
+    tokens_per_second: float = 0.0
+
+
+class BatchResponse(BaseModel):
+    items: list[BatchItemResult]
+    prompt_tokens: int
+    completion_tokens: int
+    seconds: float
+    tokens_per_second: float
@@ -1,22 +1,46 @@
-from fastapi import FastAPI, status, HTTPException, Depends
+from fastapi import FastAPI, status, HTTPException, Depends, Header
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, JSONResponse
 from schema import UserOut, UserAuth, TokenSchema, SystemUser
-from config import REDIS_HOST, REDIS_PORT, REDIS_PASSWORD, REDIS_DB
-from redis import Redis
+from config import HASH_WORKERS, HASH_MAX_PENDING
 import ujson as json
 from utils import (
-    get_hashed_password,
     create_access_token,
     create_refresh_token,
-    verify_password,
 )
+from hashing import PasswordHasher, HasherBusyError
 from uuid import uuid4
 from deps import get_current_user
+from keys import keyring
+from store import db, users, pool_stats
+from metrics import RequestMetricsMiddleware, register_stats, metrics_response
 
-db = Redis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=REDIS_DB)
+hasher = PasswordHasher(workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING)
 
 app = FastAPI()
+app.add_middleware(RequestMetricsMiddleware)
+
+register_stats("auth_hasher", hasher.stats, "Password hashing pool")
+register_stats("auth_user_cache", users.stats, "User record cache")
+register_stats("auth_redis_pool", pool_stats, "Redis connection pool")
+
+
+@app.on_event("startup")
+async def start_user_cache():
+    await users.start()
+
+
+@app.on_event("shutdown")
+async def stop_services():
+    await users.stop()
+    hasher.shutdown()
+    await db.aclose()
+
+
+@app.exception_handler(HasherBusyError)
+async def hasher_busy(request, exc):
+    # signup and login back off while bcrypt is saturated, everything else keeps being served
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"detail": str(exc)}, headers={"Retry-After": "1"})
 
 
 @app.get("/", response_class=RedirectResponse, include_in_schema=False)
@@ -24,11 +48,16 @@ async def docs():
     return RedirectResponse(url="/docs")
 
 
+@app.get("/.well-known/jwks.json", summary="Public keys for verifying access tokens")
+async def jwks():
+    # empty when tokens are signed with the shared secret
+    return keyring.jwks() if keyring is not None else {"keys": []}
+
+
 @app.post("/api/v1/signup", summary="Create new user", response_model=UserOut)
 async def create_user(data: UserAuth):
-    # querying database to check if user already exist
-    user = db.get(data.email)
-    if user is not None:
+    # a taken email is refused before it costs a hash and a hasher slot, set NX below stays the atomic guard
+    if await db.exists(data.email):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="User with this email already exist",
@@ -36,10 +65,15 @@ async def create_user(data: UserAuth):
     user = {
         "role": "user",
         "email": data.email,
-        "password": get_hashed_password(data.password),
+        "password": await hasher.hash(data.password),
         "id": str(uuid4()),
     }
-    db.set(data.email, json.dumps(user))  # saving user to database
+    # saving user to database, only if the email is not taken yet (checked and set atomically)
+    if not await db.set(data.email, json.dumps(user), nx=True):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="User with this email already exist",
+        )
     return user
 
 
@@ -49,24 +83,29 @@ async def create_user(data: UserAuth):
     response_model=TokenSchema,
 )
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = db.get(form_data.username)
+    user = await users.get(form_data.username)
     
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Incorrect email or password",
         )
-    user = json.loads(user)
     hashed_pass = user["password"]
-    if not verify_password(form_data.password, hashed_pass):
+    valid, new_hash = await hasher.verify_and_update(form_data.password, hashed_pass)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Incorrect email or password",
         )
+    if new_hash is not None:
+        # BCRYPT_ROUNDS changed since this hash was made
+        user = {**user, "password": new_hash}
+        await db.set(user["email"], json.dumps(user))
 
     return {
         "role":user["role"],
-        "access_token": create_access_token(user["email"]),
+        # id and role ride along so that services verifying the token locally do not need /me
+        "access_token": create_access_token(user["email"], claims={"uid": user["id"], "role": user["role"]}),
         "refresh_token": create_refresh_token(user["email"]),
     }
 
@@ -76,3 +115,19 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
 )
 async def get_me(user: SystemUser = Depends(get_current_user)):
     return user
+
+
+@app.get("/api/v1/hasher", summary="Password hashing pool usage")
+async def get_hasher():
+    return hasher.stats()
+
+
+@app.get("/api/v1/users/cache", summary="User record cache usage")
+async def get_user_cache():
+    return users.stats()
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(accept: str = Header(None)):
+    # prometheus scrape endpoint: bcrypt wait and run time, user lookups, redis pool
+    return metrics_response(accept)
@@ -2,10 +2,27 @@ import os
 
 ACCESS_TOKEN_EXPIRE_MINUTES = 30  # 30 minutes
 REFRESH_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7 # 7 days
-ALGORITHM = "HS256"
+# HS256 signs access tokens with JWT_SECRET_KEY, only this service can verify them.
+# RS256 signs them with the private keys in JWT_KEYS_DIR and publishes the public keys
+# at /.well-known/jwks.json so other services can verify tokens locally.
+ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
+REFRESH_ALGORITHM = "HS256"
+JWT_KEYS_DIR = os.getenv("JWT_KEYS_DIR", "/app/keys")
+JWT_ACTIVE_KID = os.getenv("JWT_ACTIVE_KID") or None
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "secret")
 JWT_REFRESH_SECRET_KEY = os.getenv("JWT_REFRESH_SECRET_KEY", "secret")
 REDIS_HOST = os.getenv("REDIS_HOST", "127.0.0.1")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", "admin")
-REDIS_DB = os.getenv("REDIS_DB", 0)
\ No newline at end of file
+REDIS_DB = int(os.getenv("REDIS_DB", 0))
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 100))
+# user records cached in process, invalidated through redis keyspace notifications. 0 disables the cache
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 300))  # seconds
+# turn on the keyspace notifications the cache needs, disable where CONFIG SET is not allowed
+REDIS_CONFIGURE_NOTIFICATIONS = os.getenv("REDIS_CONFIGURE_NOTIFICATIONS", "true").lower() == "true"
+# bcrypt cost factor, stored hashes with another cost are rehashed on the next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+# bcrypt runs on a thread pool of HASH_WORKERS threads, at most HASH_MAX_PENDING more wait for one
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", os.cpu_count() or 1))
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", 64))
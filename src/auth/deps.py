@@ -1,4 +1,3 @@
-import ujson as json
 from typing import Union, Any
 from datetime import datetime
 from fastapi import Depends, HTTPException, status
@@ -7,22 +6,26 @@ from utils import (
     ALGORITHM,
     JWT_SECRET_KEY
 )
+from keys import keyring
 from jose import jwt
 from pydantic import ValidationError
 from schema import TokenPayload, SystemUser
-from config import REDIS_HOST, REDIS_PORT, REDIS_PASSWORD, REDIS_DB
-from redis import Redis
+from store import users
 reuseable_oauth = OAuth2PasswordBearer(
     tokenUrl="api/v1/login",
     scheme_name="JWT"
 )
 
-db = Redis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=REDIS_DB)
-
 async def get_current_user(token: str = Depends(reuseable_oauth)) -> SystemUser:
     try:
+        if keyring is None:
+            key = JWT_SECRET_KEY
+        else:
+            key = keyring.public_keys.get(jwt.get_unverified_header(token).get("kid"))
+            if key is None:
+                raise jwt.JWTError("Unknown signing key")
         payload = jwt.decode(
-            token, JWT_SECRET_KEY, algorithms=[ALGORITHM]
+            token, key, algorithms=[ALGORITHM]
         )
         token_data = TokenPayload(**payload)
         
@@ -39,7 +42,7 @@ async def get_current_user(token: str = Depends(reuseable_oauth)) -> SystemUser:
             headers={"WWW-Authenticate": "Bearer"},
         )
         
-    user: Union[dict[str, Any], None] = db.get(token_data.sub)
+    user: Union[dict[str, Any], None] = await users.get(token_data.sub)
     
     
     if user is None:
@@ -47,6 +50,5 @@ async def get_current_user(token: str = Depends(reuseable_oauth)) -> SystemUser:
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Could not find user",
         )
-    user = json.loads(user)
     
     return SystemUser(**user)
\ No newline at end of file
@@ -0,0 +1,73 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils import get_hashed_password, verify_and_update_password
+from metrics import HASH_WAIT_SECONDS, HASH_RUN_SECONDS, observe
+
+
+class HasherBusyError(Exception):
+    pass
+
+
+class PasswordHasher:
+    # bcrypt takes a few hundred milliseconds per call and releases the GIL while it runs, so it is
+    # moved to a bounded thread pool and the event loop keeps serving other requests (like /me) meanwhile.
+    # when every worker is busy and max_pending calls already wait, new ones are refused instead of queued.
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    async def _run(self, operation: str, fn, *args):
+        if self.in_flight >= self.workers + self.max_pending:
+            self.rejected += 1
+            raise HasherBusyError("Password hashing is saturated")
+        self.in_flight += 1
+        submitted = time.monotonic()
+        timings = []
+
+        def timed():
+            started = time.monotonic()
+            try:
+                return fn(*args)
+            finally:
+                timings.extend([started - submitted, time.monotonic() - started])
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, timed)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            # observed here and not on the thread, where the request id is not set
+            if timings:
+                wait, run = timings
+                self.wait_seconds += wait
+                self.run_seconds += run
+                observe(HASH_WAIT_SECONDS.labels(operation), wait)
+                observe(HASH_RUN_SECONDS.labels(operation), run)
+
+    async def hash(self, password: str) -> str:
+        return await self._run("hash", get_hashed_password, password)
+
+    async def verify_and_update(self, password: str, hashed_pass: str) -> tuple[bool, str | None]:
+        return await self._run("verify", verify_and_update_password, password, hashed_pass)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "busy": min(self.in_flight, self.workers),
+            "waiting": max(self.in_flight - self.workers, 0),
+            "max_pending": self.max_pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_seconds": self.wait_seconds / self.completed if self.completed else 0.0,
+            "avg_run_seconds": self.run_seconds / self.completed if self.completed else 0.0,
+        }
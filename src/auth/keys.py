@@ -0,0 +1,71 @@
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk
+from config import ALGORITHM, JWT_KEYS_DIR, JWT_ACTIVE_KID
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def generate_key(keys_dir: str = JWT_KEYS_DIR) -> str:
+    # writes a new RSA private key as <kid>.pem, kids are timestamps so the newest sorts last
+    os.makedirs(keys_dir, exist_ok=True)
+    kid = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption(),
+    )
+    path = os.path.join(keys_dir, f"{kid}.pem")
+    with open(path, "wb") as f:
+        f.write(pem)
+    os.chmod(path, 0o600)
+    return kid
+
+
+class KeyRing:
+    # private keys used for asymmetric token signing. tokens are signed with the active key only,
+    # every key in the ring is published in the JWKS so that tokens signed before a rotation stay
+    # valid until the old key file is removed.
+    def __init__(self, keys_dir: str, active_kid: str = None):
+        if not os.path.isdir(keys_dir) or not any(name.endswith(".pem") for name in os.listdir(keys_dir)):
+            # fine for a single instance, replicas must share the keys directory to accept each other's tokens
+            kid = generate_key(keys_dir)
+            logger.warning("No signing keys in %s, generated %s", keys_dir, kid)
+
+        self.private_keys = {}
+        for name in sorted(os.listdir(keys_dir)):
+            if name.endswith(".pem"):
+                with open(os.path.join(keys_dir, name)) as f:
+                    self.private_keys[name[: -len(".pem")]] = f.read()
+
+        self.active_kid = active_kid or list(self.private_keys)[-1]
+        if self.active_kid not in self.private_keys:
+            raise ValueError(f"Active signing key {self.active_kid} is not in {keys_dir}")
+
+        self.public_keys = {}
+        for kid, pem in self.private_keys.items():
+            public_key = jwk.construct(pem, ALGORITHM).public_key().to_dict()
+            public_key.update({"kid": kid, "use": "sig", "alg": ALGORITHM})
+            self.public_keys[kid] = public_key
+
+    def signing_key(self) -> tuple[str, str]:
+        return self.active_kid, self.private_keys[self.active_kid]
+
+    def jwks(self) -> dict:
+        return {"keys": list(self.public_keys.values())}
+
+
+keyring = KeyRing(JWT_KEYS_DIR, JWT_ACTIVE_KID) if ALGORITHM != "HS256" else None
+
+
+if __name__ == "__main__":
+    # key rotation: `python auth/keys.py generate` adds a key, restart auth (or set JWT_ACTIVE_KID) to sign with it
+    if sys.argv[1:] == ["generate"]:
+        print(generate_key())
+    else:
+        print("usage: python auth/keys.py generate")
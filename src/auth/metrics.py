@@ -0,0 +1,23 @@
+from prometheus_client import Histogram
+from common.metrics import (
+    REQUEST_ID_HEADER,
+    REQUEST_SECONDS,
+    RequestMetricsMiddleware,
+    metrics_response,
+    observe,
+    register_stats,
+    request_id,
+)
+
+HASH_WAIT_SECONDS = Histogram(
+    "auth_hash_wait_seconds", "Time a bcrypt call waited for a hashing thread", ["operation"]
+)
+HASH_RUN_SECONDS = Histogram(
+    "auth_hash_run_seconds", "Time of one bcrypt call", ["operation"], buckets=(0.01, 0.025, 0.05, 0.1, 0.2, 0.4, 0.8, 1.6, 3.2)
+)
+USER_LOOKUP_SECONDS = Histogram(
+    "auth_user_lookup_seconds",
+    "Time to fetch a user record, from the in-process cache or from redis",
+    ["source"],
+    buckets=(0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
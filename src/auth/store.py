@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+import ujson as json
+import redis.asyncio as redis
+from config import (
+    REDIS_HOST,
+    REDIS_PORT,
+    REDIS_PASSWORD,
+    REDIS_DB,
+    REDIS_MAX_CONNECTIONS,
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL,
+    REDIS_CONFIGURE_NOTIFICATIONS,
+)
+from metrics import USER_LOOKUP_SECONDS, observe
+
+logger = logging.getLogger("uvicorn.error")
+
+# keyspace events the cache needs: generic (del, expire, rename), string (set) and expired/evicted keys
+NOTIFY_FLAGS = "Kg$xe"
+
+# one connection pool for the whole service
+pool = redis.ConnectionPool(
+    host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=REDIS_DB, max_connections=REDIS_MAX_CONNECTIONS
+)
+db = redis.Redis(connection_pool=pool)
+
+
+def pool_stats() -> dict:
+    return {
+        "max_connections": pool.max_connections,
+        "in_use": len(pool._in_use_connections),
+        "available": len(pool._available_connections),
+    }
+
+
+class UserCache:
+    # in-process copy of user records keyed by email, so /me usually needs no redis round trip.
+    # it is kept coherent through redis keyspace notifications: every write to a user key drops the
+    # cached record. while the notification subscription is down the cache is bypassed, and entries
+    # expire after ttl regardless.
+    def __init__(self, redis_client: redis.Redis, max_size: int, ttl: float):
+        self.redis = redis_client
+        self.max_size = max_size
+        self.ttl = ttl
+        self.listening = False
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        # bumped by every invalidation, a record read before an invalidation is not cached after it
+        self._generation = 0
+        self._task = None
+
+    async def start(self):
+        if self.max_size <= 0:
+            return
+        if REDIS_CONFIGURE_NOTIFICATIONS:
+            try:
+                current = (await self.redis.config_get("notify-keyspace-events")).get("notify-keyspace-events", "")
+                flags = "".join(sorted(set(current) | set(NOTIFY_FLAGS)))
+                await self.redis.config_set("notify-keyspace-events", flags)
+            except redis.RedisError as e:
+                logger.warning("Could not enable redis keyspace notifications: %s", e)
+        self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def get(self, email: str) -> dict | None:
+        started = time.perf_counter()
+        if self.listening:
+            entry = self._entries.get(email)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(email)
+                self.hits += 1
+                observe(USER_LOOKUP_SECONDS.labels("cache"), time.perf_counter() - started)
+                return entry[1]
+        self.misses += 1
+
+        generation = self._generation
+        user = await self.redis.get(email)
+        observe(USER_LOOKUP_SECONDS.labels("redis"), time.perf_counter() - started)
+        if user is None:
+            return None
+        user = json.loads(user)
+        if self.listening and generation == self._generation:
+            self._entries[email] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(email)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, email: str):
+        self._generation += 1
+        self.invalidations += 1
+        self._entries.pop(email, None)
+
+    def clear(self):
+        self._generation += 1
+        self._entries.clear()
+
+    async def _listen(self):
+        prefix = f"__keyspace@{REDIS_DB}__:"
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.psubscribe(f"{prefix}*")
+                # events may have been missed while not subscribed
+                self.clear()
+                self.listening = True
+                async for message in pubsub.listen():
+                    if message["type"] == "pmessage":
+                        self.invalidate(message["channel"].decode("utf-8")[len(prefix):])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Lost redis keyspace notifications, user cache bypassed: %s", e)
+            finally:
+                self.listening = False
+                await pubsub.aclose()
+            await asyncio.sleep(1)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "listening": self.listening,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
+
+
+users = UserCache(db, max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
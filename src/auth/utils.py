@@ -7,10 +7,13 @@ from config import (
     JWT_REFRESH_SECRET_KEY,
     JWT_SECRET_KEY,
     ALGORITHM,
+    REFRESH_ALGORITHM,
     REFRESH_TOKEN_EXPIRE_MINUTES,
+    BCRYPT_ROUNDS,
 )
+from keys import keyring
 
-password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 
 def get_hashed_password(password: str) -> str:
@@ -21,7 +24,12 @@ def verify_password(password: str, hashed_pass: str) -> bool:
     return password_context.verify(password, hashed_pass)
 
 
-def create_access_token(subject: Union[str, Any], expires_delta: int = None) -> str:
+def verify_and_update_password(password: str, hashed_pass: str) -> tuple[bool, str | None]:
+    # the second value is a new hash when the stored one was made with another cost
+    return password_context.verify_and_update(password, hashed_pass)
+
+
+def create_access_token(subject: Union[str, Any], expires_delta: int = None, claims: dict = None) -> str:
     if expires_delta is not None:
         expires_delta = datetime.utcnow() + expires_delta
     else:
@@ -29,9 +37,12 @@ def create_access_token(subject: Union[str, Any], expires_delta: int = None) ->
             minutes=ACCESS_TOKEN_EXPIRE_MINUTES
         )
 
-    to_encode = {"exp": expires_delta, "sub": str(subject)}
-    encoded_jwt = jwt.encode(to_encode, JWT_SECRET_KEY, ALGORITHM)
-    return encoded_jwt
+    to_encode = {"exp": expires_delta, "sub": str(subject), **(claims or {})}
+    if keyring is None:
+        return jwt.encode(to_encode, JWT_SECRET_KEY, ALGORITHM)
+    # the kid header tells verifiers which published key to check the signature with
+    kid, private_key = keyring.signing_key()
+    return jwt.encode(to_encode, private_key, ALGORITHM, headers={"kid": kid})
 
 
 def create_refresh_token(subject: Union[str, Any], expires_delta: int = None) -> str:
@@ -43,5 +54,5 @@ def create_refresh_token(subject: Union[str, Any], expires_delta: int = None) ->
         )
 
     to_encode = {"exp": expires_delta, "sub": str(subject)}
-    encoded_jwt = jwt.encode(to_encode, JWT_REFRESH_SECRET_KEY, ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, JWT_REFRESH_SECRET_KEY, REFRESH_ALGORITHM)
     return encoded_jwt
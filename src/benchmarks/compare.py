@@ -0,0 +1,41 @@
+# compares two load.py results phase by phase, e.g. before and after a change
+#
+# usage: python benchmarks/compare.py before.json after.json
+import argparse
+import ujson as json
+
+METRICS = [("rps", ("rps",)), *[(name, ("latency_ms", name)) for name in ("p50", "p95", "p99")]]
+
+
+def lookup(result: dict, phase: str, path: tuple) -> float | None:
+    value = result["phases"].get(phase)
+    for key in path:
+        if value is None:
+            return None
+        value = value.get(key)
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two load benchmark results")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    print(f"{'phase':<10} {'metric':<8} {before.get('revision') or 'before':>12} {after.get('revision') or 'after':>12} {'change':>9}")
+    for phase in after["phases"]:
+        for name, path in METRICS:
+            old, new = lookup(before, phase, path), lookup(after, phase, path)
+            if old is None or new is None:
+                continue
+            change = f"{(new - old) / old * 100:+.1f}%" if old else "-"
+            print(f"{phase:<10} {name:<8} {old:>12.2f} {new:>12.2f} {change:>9}")
+
+
+if __name__ == "__main__":
+    main()
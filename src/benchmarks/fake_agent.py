@@ -0,0 +1,56 @@
+# stand-in for the agent service: answers with canned tokens after a fixed delay per token,
+# so the dialogue manager can be load tested without a model.
+#
+# usage: FAKE_TOKEN_DELAY=0.02 FAKE_REPLY_TOKENS=16 uvicorn fake_agent:app --port 8083
+import asyncio
+import os
+import ujson as json
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+TOKEN_DELAY = float(os.getenv("FAKE_TOKEN_DELAY", 0.02))  # seconds per generated token
+REPLY_TOKENS = int(os.getenv("FAKE_REPLY_TOKENS", 16))
+
+app = FastAPI()
+
+
+class TokenizeRequest(BaseModel):
+    texts: list[str]
+
+
+def reply_tokens() -> list:
+    return [f" token{i}" for i in range(REPLY_TOKENS)]
+
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    return {"ready": True}
+
+
+@app.get("/api/v1/agent")
+async def llama(prompt: str, cache: bool = True):
+    await asyncio.sleep(TOKEN_DELAY * REPLY_TOKENS)
+    return "".join(reply_tokens())
+
+
+@app.get("/api/v1/agent/stream")
+async def llama_stream(prompt: str, cache: bool = True):
+    async def relay():
+        for token in reply_tokens():
+            await asyncio.sleep(TOKEN_DELAY)
+            yield json.dumps({"token": token}) + "\n"
+
+    return StreamingResponse(relay(), media_type="application/x-ndjson")
+
+
+@app.post("/api/v1/agent/tokenize")
+async def tokenize(data: TokenizeRequest):
+    # about one token per word is close enough for the dialogue manager's context budget
+    return {"counts": [len(text.split()) for text in data.texts]}
+
@@ -0,0 +1,200 @@
+# load benchmark of the auth and dialogue manager services.
+# every virtual user signs up, logs in, creates a dialogue, continues it --turns times and lists its
+# dialogues. each step runs as its own phase over all users, at most --concurrency requests in flight,
+# and is reported with p50/p95/p99 latency and requests/sec as JSON.
+#
+# usage: python benchmarks/load.py --users 50 --concurrency 10 --turns 5 --output before.json
+# local stand-ins are started (fake agent, fakeredis, SQLite) unless --auth-url and --dm-url are given.
+# see compare.py to diff two results.
+import argparse
+import asyncio
+import math
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from uuid import uuid4
+import httpx
+import ujson as json
+from stack import LocalStack
+
+PHASES = ["signup", "login", "create", "continue", "list"]
+
+
+def percentile(values: list, p: float) -> float:
+    # nearest rank, on sorted values
+    if len(values) == 0:
+        return 0.0
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+class Phase:
+    def __init__(self, name: str, concurrency: int):
+        self.name = name
+        self.in_flight = asyncio.Semaphore(concurrency)
+        self.latencies = []
+        self.statuses = Counter()
+        self.errors = 0
+        self.seconds = 0.0
+
+    async def request(self, send) -> httpx.Response | None:
+        # returns the response of a successful request, None for a failed one
+        async with self.in_flight:
+            started = time.perf_counter()
+            try:
+                response = await send()
+            except httpx.HTTPError as e:
+                self.errors += 1
+                self.statuses[type(e).__name__] += 1
+                return None
+            self.latencies.append(time.perf_counter() - started)
+        self.statuses[str(response.status_code)] += 1
+        if response.status_code != 200:
+            self.errors += 1
+            return None
+        return response
+
+    async def run(self, tasks: list):
+        started = time.perf_counter()
+        await asyncio.gather(*tasks)
+        self.seconds = time.perf_counter() - started
+
+    def report(self) -> dict:
+        latencies = sorted(self.latencies)
+        ok = sum(count for status, count in self.statuses.items() if status == "200")
+        return {
+            "requests": sum(self.statuses.values()),
+            "errors": self.errors,
+            "statuses": dict(self.statuses),
+            "seconds": self.seconds,
+            "rps": ok / self.seconds if self.seconds > 0 else 0.0,
+            "latency_ms": {
+                "mean": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+                "p50": percentile(latencies, 50) * 1000,
+                "p95": percentile(latencies, 95) * 1000,
+                "p99": percentile(latencies, 99) * 1000,
+                "max": latencies[-1] * 1000 if latencies else 0.0,
+            },
+        }
+
+
+async def run_load(auth_url: str, dm_url: str, users: int, concurrency: int, turns: int, lists: int) -> dict:
+    run_id = uuid4().hex[:8]
+    emails = [f"bench-{run_id}-{i}@example.com" for i in range(users)]
+    password = "bench-password"
+    tokens = {}
+    dialogues = {}
+    phases = {name: Phase(name, concurrency) for name in PHASES}
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=300, limits=limits) as client:
+
+        async def signup(email: str):
+            await phases["signup"].request(
+                lambda: client.post(f"{auth_url}/api/v1/signup", json={"email": email, "password": password})
+            )
+
+        async def login(email: str):
+            response = await phases["login"].request(
+                lambda: client.post(f"{auth_url}/api/v1/login", data={"username": email, "password": password})
+            )
+            if response is not None:
+                tokens[email] = "Bearer " + response.json()["access_token"]
+
+        async def create(email: str):
+            response = await phases["create"].request(
+                lambda: client.post(
+                    f"{dm_url}/api/v1/dialogue", params={"message": "hello"}, headers={"auth": tokens[email]}
+                )
+            )
+            if response is not None:
+                dialogues[email] = response.json()["reply"]["dialogue_id"]
+
+        async def proceed(email: str):
+            # the turns of one dialogue follow each other, dialogues run concurrently
+            for turn in range(turns):
+                await phases["continue"].request(
+                    lambda: client.post(
+                        f"{dm_url}/api/v1/dialogue",
+                        params={"message": f"message {turn}", "dialogue_id": dialogues[email]},
+                        headers={"auth": tokens[email]},
+                    )
+                )
+
+        async def list_dialogues(email: str):
+            for _ in range(lists):
+                await phases["list"].request(
+                    lambda: client.get(f"{dm_url}/api/v1/dialogues", params={"limit": 10}, headers={"auth": tokens[email]})
+                )
+
+        await phases["signup"].run([signup(email) for email in emails])
+        await phases["login"].run([login(email) for email in emails])
+        await phases["create"].run([create(email) for email in emails if email in tokens])
+        await phases["continue"].run([proceed(email) for email in emails if email in dialogues])
+        await phases["list"].run([list_dialogues(email) for email in emails if email in tokens])
+
+    return {name: phase.report() for name, phase in phases.items()}
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load benchmark of the auth and dialogue manager services")
+    parser.add_argument("--users", type=int, default=20, help="virtual users, each with one dialogue")
+    parser.add_argument("--concurrency", type=int, default=10, help="requests in flight at most")
+    parser.add_argument("--turns", type=int, default=5, help="continuations of every dialogue")
+    parser.add_argument("--lists", type=int, default=5, help="dialogue list requests per user")
+    parser.add_argument("--auth-url", help="a running auth service, e.g. http://127.0.0.1:8080")
+    parser.add_argument("--dm-url", help="a running dialogue manager, e.g. http://127.0.0.1:8081")
+    parser.add_argument("--database-url", help="local stack: async SQLAlchemy url, a fresh SQLite file by default")
+    parser.add_argument("--redis-host", help="local stack: a running redis, fakeredis by default")
+    parser.add_argument("--redis-port", type=int, default=6379)
+    parser.add_argument("--redis-password", default="")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="local stack: seconds per fake agent token")
+    parser.add_argument("--reply-tokens", type=int, default=16, help="local stack: tokens per fake agent reply")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12, help="local stack: bcrypt cost of the auth service")
+    parser.add_argument("--output", help="write the JSON result here instead of stdout")
+    args = parser.parse_args()
+
+    result = {
+        "revision": git_revision(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            key: value for key, value in vars(args).items() if key not in ("output", "redis_password")
+        },
+    }
+    workload = dict(users=args.users, concurrency=args.concurrency, turns=args.turns, lists=args.lists)
+    if args.auth_url and args.dm_url:
+        result["phases"] = asyncio.run(run_load(args.auth_url, args.dm_url, **workload))
+    else:
+        stack = LocalStack(
+            database_url=args.database_url,
+            redis_host=args.redis_host,
+            redis_port=args.redis_port,
+            redis_password=args.redis_password,
+            token_delay=args.token_delay,
+            reply_tokens=args.reply_tokens,
+            bcrypt_rounds=args.bcrypt_rounds,
+        )
+        with stack:
+            print(f"services up, logs in {stack.log_dir}", file=sys.stderr)
+            result["phases"] = asyncio.run(run_load(stack.auth_url, stack.dm_url, **workload))
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
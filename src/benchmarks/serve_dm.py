@@ -0,0 +1,55 @@
+# runs the dialogue manager against any async SQLAlchemy url, so benchmarks work with a local
+# Postgres or with nothing but a SQLite file. the schema is created before serving.
+#
+# usage: python benchmarks/serve_dm.py --database-url sqlite+aiosqlite:///bench.db --port 8081
+import argparse
+import asyncio
+import os
+import sys
+import uvicorn
+from sqlalchemy import event
+
+DM_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dialogue_manager")
+
+
+def prepare_sqlite(dbapi_connection, connection_record):
+    # postgres functions the dialogue manager's queries use, and WAL so readers do not wait on the writer
+    dbapi_connection.create_function(
+        "octet_length", 1, lambda value: None if value is None else len(str(value).encode("utf-8"))
+    )
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.close()
+
+
+async def create_schema():
+    from database import engine
+    from models import create_schema
+
+    async with engine.begin() as conn:
+        await conn.run_sync(create_schema)
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the dialogue manager for benchmarks")
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = args.database_url
+    sys.path.insert(0, DM_DIR)
+    import database
+
+    if database.engine.dialect.name == "sqlite":
+        event.listen(database.engine.sync_engine, "connect", prepare_sqlite)
+
+    asyncio.run(create_schema())
+    from app import app
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
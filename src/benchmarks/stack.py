@@ -0,0 +1,156 @@
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import httpx
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+BENCH_DIR = os.path.join(SRC_DIR, "benchmarks")
+
+
+def service_env(env: dict = None) -> dict:
+    # the services import the shared code in src/common as `common`, like the images do from /app
+    python_path = os.pathsep.join(filter(None, [SRC_DIR, os.environ.get("PYTHONPATH")]))
+    return {**os.environ, "PYTHONPATH": python_path, **(env or {})}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{' '.join(process.args)} exited with {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout} seconds")
+
+
+class LocalStack:
+    # auth, dialogue manager and a fake agent as local processes, wired to each other.
+    # auth uses the given redis or an in-process fakeredis server, the dialogue manager the
+    # given database url or a fresh SQLite file. every process inherits this environment,
+    # so service settings (MESSAGE_DURABILITY, DIALOGUE_HEADS, ...) are set as usual.
+    def __init__(
+        self,
+        database_url: str = None,
+        redis_host: str = None,
+        redis_port: int = 6379,
+        redis_password: str = "",
+        token_delay: float = 0.02,
+        reply_tokens: int = 16,
+        bcrypt_rounds: int = 12,
+        log_dir: str = None,
+    ):
+        self.workdir = tempfile.mkdtemp(prefix="ifs-bench-")
+        self.database_url = database_url or f"sqlite+aiosqlite:///{os.path.join(self.workdir, 'dm.db')}"
+        self.redis_host = redis_host
+        self.redis_port = redis_port
+        self.redis_password = redis_password
+        self.token_delay = token_delay
+        self.reply_tokens = reply_tokens
+        self.bcrypt_rounds = bcrypt_rounds
+        self.log_dir = log_dir or self.workdir
+        self.processes = []
+        self.redis_server = None
+        self.auth_url = None
+        self.dm_url = None
+        self.agent_url = None
+
+    def start_redis(self):
+        # fakeredis speaks the redis protocol on a local port, auth connects to it unchanged
+        from fakeredis import TcpFakeServer
+
+        self.redis_host, self.redis_port = "127.0.0.1", free_port()
+        self.redis_server = TcpFakeServer((self.redis_host, self.redis_port))
+        threading.Thread(target=self.redis_server.serve_forever, daemon=True).start()
+
+    def spawn(self, name: str, args: list, cwd: str, env: dict, port: int) -> str:
+        log = open(os.path.join(self.log_dir, f"{name}.log"), "w")
+        process = subprocess.Popen(
+            [sys.executable, *args],
+            cwd=cwd,
+            env=service_env(env),
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+        self.processes.append(process)
+        url = f"http://127.0.0.1:{port}"
+        wait_until_up(f"{url}/docs", process)
+        return url
+
+    def start(self):
+        if self.redis_host is None:
+            self.start_redis()
+
+        port = free_port()
+        self.agent_url = self.spawn(
+            "agent",
+            ["-m", "uvicorn", "fake_agent:app", "--port", str(port), "--log-level", "warning"],
+            cwd=BENCH_DIR,
+            env={"FAKE_TOKEN_DELAY": str(self.token_delay), "FAKE_REPLY_TOKENS": str(self.reply_tokens)},
+            port=port,
+        )
+
+        port = free_port()
+        self.auth_url = self.spawn(
+            "auth",
+            ["-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+            cwd=os.path.join(SRC_DIR, "auth"),
+            env={
+                "REDIS_HOST": self.redis_host,
+                "REDIS_PORT": str(self.redis_port),
+                "REDIS_PASSWORD": self.redis_password,
+                "BCRYPT_ROUNDS": str(self.bcrypt_rounds),
+                "JWT_KEYS_DIR": os.path.join(self.workdir, "keys"),
+            },
+            port=port,
+        )
+
+        port = free_port()
+        self.dm_url = self.spawn(
+            "dm",
+            ["serve_dm.py", "--database-url", self.database_url, "--port", str(port)],
+            cwd=BENCH_DIR,
+            env={
+                "AUTH_URL": f"{self.auth_url}/api/v1/me",
+                "AUTH_JWKS_URL": f"{self.auth_url}/.well-known/jwks.json",
+                "AGENT_URL": f"{self.agent_url}/api/v1/agent",
+                "AGENT_STREAM_URL": f"{self.agent_url}/api/v1/agent/stream",
+                "AGENT_TOKENIZE_URL": f"{self.agent_url}/api/v1/agent/tokenize",
+            },
+            port=port,
+        )
+
+    def stop(self):
+        for process in reversed(self.processes):
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if self.redis_server is not None:
+            self.redis_server.shutdown()
+
+    def __enter__(self):
+        try:
+            self.start()
+        except Exception:
+            self.stop()
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
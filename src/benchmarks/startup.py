@@ -0,0 +1,103 @@
+# startup cost of the dialogue manager: time and resident memory to import the app, and time until a
+# fresh process answers HTTP, reported as JSON. no database is needed, the service only connects on
+# its first query.
+#
+# usage: python benchmarks/startup.py [--repeat 5] [--output startup.json]
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import httpx
+import ujson as json
+from stack import SRC_DIR, free_port, service_env
+
+DM_DIR = os.path.join(SRC_DIR, "dialogue_manager")
+
+IMPORT_PROBE = """
+import json, resource, time
+started = time.perf_counter()
+import app
+print(json.dumps({"seconds": time.perf_counter() - started, "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+
+def rss_mb(pid: int) -> float | None:
+    # linux only
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def measure_import() -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE], cwd=DM_DIR, env=service_env(), capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure_ready(timeout: float = 60) -> dict:
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=DM_DIR,
+        env=service_env(),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                return {"seconds": None, "rss_mb": None, "error": f"exited with {process.returncode}"}
+            try:
+                httpx.get(f"http://127.0.0.1:{port}/docs", timeout=1)
+                return {"seconds": time.perf_counter() - started, "rss_mb": rss_mb(process.pid)}
+            except httpx.TransportError:
+                time.sleep(0.01)
+        return {"seconds": None, "rss_mb": None, "error": "timed out"}
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def summarize(samples: list) -> dict:
+    values = [sample["seconds"] for sample in samples if sample["seconds"] is not None]
+    memory = [sample["rss_mb"] for sample in samples if sample["rss_mb"] is not None]
+    summary = {
+        "seconds_median": statistics.median(values) if values else None,
+        "seconds_min": min(values) if values else None,
+        "rss_mb_median": statistics.median(memory) if memory else None,
+    }
+    errors = [sample["error"] for sample in samples if "error" in sample]
+    if errors:
+        summary["errors"] = errors
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time and memory of the dialogue manager")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write the JSON result here instead of stdout")
+    args = parser.parse_args()
+
+    result = {
+        "import": summarize([measure_import() for _ in range(args.repeat)]),
+        "ready": summarize([measure_ready() for _ in range(args.repeat)]),
+    }
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# request ids, the request duration histogram and the /metrics exposition shared by all services.
+# each service's own metrics.py declares its metrics next to these and is what its modules import.
+import time
+from contextvars import ContextVar
+from uuid import uuid4
+from fastapi import Response
+from prometheus_client import REGISTRY, CONTENT_TYPE_LATEST, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.openmetrics.exposition import (
+    CONTENT_TYPE_LATEST as OPENMETRICS_CONTENT_TYPE,
+    generate_latest as generate_openmetrics,
+)
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# id of the request being handled. the dialogue manager sends the id of its turn along to auth and
+# agent, so one turn can be followed through all three services
+request_id = ContextVar("request_id", default=None)
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Time to handle a request, until its last byte is sent", ["handler", "method", "status"]
+)
+
+
+def observe(histogram, value: float, current: str | None = None):
+    # the request id is kept as an exemplar, so a slow bucket points to a turn that landed in it.
+    # work done outside the request (e.g. on the agent's scheduler) passes the id it was queued with
+    current = current or request_id.get()
+    histogram.observe(value, exemplar={"request_id": current} if current is not None else None)
+
+
+class StatsCollector:
+    # exposes the numbers of a stats() dict as gauges, read at scrape time
+    def __init__(self, prefix: str, stats, documentation: str):
+        self.prefix = prefix
+        self.stats = stats
+        self.documentation = documentation
+
+    def collect(self):
+        for key, value in self.stats().items():
+            if isinstance(value, bool):
+                value = int(value)
+            if isinstance(value, (int, float)):
+                yield GaugeMetricFamily(f"{self.prefix}_{key}", f"{self.documentation}: {key}", value=value)
+
+
+def register_stats(prefix: str, stats, documentation: str):
+    REGISTRY.register(StatsCollector(prefix, stats, documentation))
+
+
+class RequestMetricsMiddleware:
+    # gives every request an id, the caller's X-Request-ID or a new one, echoes it in the response
+    # and times the request per handler. plain ASGI so streamed responses are timed to their end.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        header = REQUEST_ID_HEADER.lower().encode("latin-1")
+        current = next((value.decode("latin-1")[:64] for name, value in scope["headers"] if name == header), None)
+        current = current or uuid4().hex
+        token = request_id.set(current)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(header, current.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            # the router leaves the matched endpoint in the scope, its name keeps the label set small
+            endpoint = scope.get("endpoint")
+            handler = endpoint.__name__ if endpoint is not None else "none"
+            if handler != "metrics":
+                observe(REQUEST_SECONDS.labels(handler, scope["method"], str(status_code)), time.perf_counter() - started)
+            request_id.reset(token)
+
+
+def metrics_response(accept: str | None) -> Response:
+    # exemplars are only part of the OpenMetrics format, scrapers ask for it in the Accept header
+    if accept is not None and "application/openmetrics-text" in accept:
+        return Response(generate_openmetrics(REGISTRY), media_type=OPENMETRICS_CONTENT_TYPE)
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
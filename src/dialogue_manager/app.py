@@ -1,53 +1,226 @@
-import uvicorn
-import requests
-import pandas as pd
+import time
 import ujson as json
+import services
+from typing import AsyncIterator
 from uuid import uuid4
-from config import INITIAL_PROMPT, AUTH_URL, AGENT_URL
-from fastapi.responses import RedirectResponse
-from fastapi import FastAPI, status, HTTPException, Header, Depends
-from sqlalchemy.orm import Session
+from config import (
+    INITIAL_PROMPT,
+    AUTH_URL,
+    AGENT_URL,
+    AGENT_STREAM_URL,
+    MEMORY_CACHE_SIZE,
+    TOKEN_CACHE_SIZE,
+    TOKEN_CACHE_TTL,
+    TOKEN_CACHE_NEGATIVE_TTL,
+    LOCAL_TOKEN_VERIFICATION,
+    AUTH_JWKS_URL,
+    JWKS_REFRESH_INTERVAL,
+    MESSAGE_DURABILITY,
+    WRITER_MAX_BATCH,
+    WRITER_MAX_PENDING,
+    WRITER_LINGER,
+    DIALOGUE_HEADS,
+    MEMORY_WINDOW_MESSAGES,
+    MEMORY_WINDOW_BYTES,
+    IDEMPOTENCY_CACHE_SIZE,
+    IDEMPOTENCY_TTL,
+)
+from contextlib import contextmanager
+from fastapi.responses import RedirectResponse, StreamingResponse
+from fastapi import FastAPI, status, HTTPException, Header, Depends, Response
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from crud import (
     get_message,
     get_user_dialogue_ids,
     get_dialogue_messages,
     get_all_dialogue_messages,
-    create_message,
+    is_dialogue_tail,
+    get_dialogue,
+    get_user_dialogues,
+    get_dialogue_first_message,
+    get_dialogue_tail_ids,
+    get_dialogue_window,
+    count_dialogue_messages,
+    put_dialogue_head,
+    dialogue_head_row,
 )
 from datetime import datetime, timezone
-from models import Base, DBMessage
+from models import DBMessage
 from schemas import SchemaMessageType, SchemaAgentMessage, SchemaMessage
-from database import SessionLocal, engine
-
-Base.metadata.create_all(bind=engine)
+from ordering import DialogueChainError, BrokenChainError, ForkedChainError, order_messages
+from memory import DialogueMemory, DialogueMemoryCache
+from context import BOT_ROLE, assemble_context
+from introspection import TokenIntrospectionCache
+from writer import MessageWriter
+from idempotency import IdempotencyStore, IdempotencyKeyReusedError, request_fingerprint
+from export import EXPORT_FORMATS, parquet_available, export_ndjson, export_parquet
+from pagination import (
+    InvalidCursorError,
+    dialogue_cursor,
+    decode_dialogue_cursor,
+    head_cursor,
+    decode_head_cursor,
+    message_cursor,
+    decode_message_cursor,
+)
+from database import SessionLocal, engine, pool_stats
+from metrics import STAGE_SECONDS, RequestMetricsMiddleware, register_stats, metrics_response, observe, stage
 
 
 # Dependency
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    # one session per request, its connection goes back to the pool when the request is done
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
+memory_cache = DialogueMemoryCache(max_size=MEMORY_CACHE_SIZE)
+token_cache = TokenIntrospectionCache(
+    max_size=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL, negative_ttl=TOKEN_CACHE_NEGATIVE_TTL
+)
+message_writer = MessageWriter(
+    session_factory=SessionLocal,
+    durability=MESSAGE_DURABILITY,
+    max_batch=WRITER_MAX_BATCH,
+    max_pending=WRITER_MAX_PENDING,
+    linger=WRITER_LINGER,
+    heads=DIALOGUE_HEADS,
+    # an acknowledged turn that could not be stored must not stay the tail of a cached memory
+    on_failure=lambda messages: memory_cache.invalidate(messages[0].dialogue_id),
+)
+idempotency_store = IdempotencyStore(max_size=IDEMPOTENCY_CACHE_SIZE, ttl=IDEMPOTENCY_TTL)
+# tails of dialogues with a turn generating in this process
+tails_in_flight = set()
+token_verifier = None
+if LOCAL_TOKEN_VERIFICATION:
+    # jose and cryptography are only loaded when tokens are verified here
+    from verifier import TokenVerifier
+
+    token_verifier = TokenVerifier(jwks_url=AUTH_JWKS_URL, refresh_interval=JWKS_REFRESH_INTERVAL)
+
 app = FastAPI()
+app.add_middleware(RequestMetricsMiddleware)
+
+register_stats("db_pool", pool_stats, "Database connection pool")
+register_stats("writer", message_writer.stats, "Message writer queue and batches")
+register_stats("idempotency", idempotency_store.stats, "Idempotency-Key results")
+
+
+@app.on_event("startup")
+async def start_services():
+    # nothing here touches the database, the schema is created by `python dialogue_manager/manage.py migrate`
+    await message_writer.start()
+    await services.start()
+    if token_verifier is not None:
+        # keys are loaded once up front, an auth service that is not up yet is retried on the first request
+        try:
+            await token_verifier.refresh()
+        except Exception:
+            pass
+
+
+@app.on_event("shutdown")
+async def stop_services():
+    await services.stop()
+    await message_writer.stop()
+    await engine.dispose()
+
 
 @app.get("/", response_class=RedirectResponse, include_in_schema=False)
 async def docs():
     return RedirectResponse(url="/docs")
 
-def get_agent_reply(message: str) -> SchemaAgentMessage:
-    bot_role = "\n CHATBOT : "
-    response = requests.get(AGENT_URL, params={"prompt": f"{message} {bot_role}"})
+async def get_user_info(auth: str) -> dict:
+    # Simple User Info Checker, answers of the auth service are cached per token
+    if auth:
+        cached = token_cache.get(auth)
+        if cached is not None:
+            status_code, user_info = cached
+            if user_info is None:
+                raise HTTPException(status_code)
+            return user_info
+        if token_verifier is not None:
+            user_info = await verify_token(auth)
+            if user_info is not None:
+                token_cache.put(auth, user_info)
+                return user_info
+
+    response = await services.send(
+        services.auth_client, "GET", AUTH_URL, headers={"Authorization": auth} if auth else {}
+    )
+    if response.status_code != 200:
+        if auth:
+            token_cache.put_invalid(auth, response.status_code)
+        raise HTTPException(response.status_code)
+
+    user_info = json.loads(response.content)
+    token_cache.put(auth, user_info)
+    return user_info
+
+async def verify_token(auth: str) -> dict | None:
+    # local verification, None means the token has to be checked by the auth service
+    # (signed with the shared secret or issued before tokens carried the user id)
+    from jose import JWTError
+
+    try:
+        claims = await token_verifier.verify(auth.split(" ")[-1])
+    except JWTError:
+        token_cache.put_invalid(auth, status.HTTP_403_FORBIDDEN)
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Could not validate credentials")
+    if claims is None or "uid" not in claims:
+        return None
+    return {"id": claims["uid"], "email": claims["sub"], "role": claims.get("role", "user")}
+
+def agent_error(response) -> HTTPException:
+    # the agent's own status is kept, so a full agent queue reaches the client as 503 with Retry-After
+    headers = {"Retry-After": response.headers["Retry-After"]} if "Retry-After" in response.headers else None
+    return HTTPException(status_code=response.status_code, detail="Agent could not reply", headers=headers)
+
+async def get_agent_reply(message: str) -> SchemaAgentMessage:
+    # generation is expensive, so it is only retried when the agent did not start it
+    response = await services.send(
+        services.agent_client, "GET", AGENT_URL, idempotent=False, params={"prompt": f"{message} {BOT_ROLE}"}
+    )
+    if response.status_code != 200:
+        raise agent_error(response)
     
     return SchemaAgentMessage(
         created_at=datetime.now(tz=timezone.utc),
-        content=response.content,
+        content=response.json(),
         message_type=SchemaMessageType.ai,
     )
 
-def create_dialogue_memory(messages: list) -> str:
+async def stream_agent_reply(message: str) -> AsyncIterator[str]:
+    response = await services.send(
+        services.agent_client,
+        "GET",
+        AGENT_STREAM_URL,
+        idempotent=False,
+        stream=True,
+        params={"prompt": f"{message} {BOT_ROLE}"},
+    )
+    try:
+        if response.status_code != 200:
+            raise agent_error(response)
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if "error" in chunk:
+                raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=chunk["error"])
+            yield chunk["token"]
+    finally:
+        await response.aclose()
+
+def windowed_memory(user_id: str, messages: list) -> DialogueMemory:
+    # every memory, loaded or cached, is bounded by the same window
+    return DialogueMemory(
+        user_id=user_id, messages=messages, max_messages=MEMORY_WINDOW_MESSAGES, max_bytes=MEMORY_WINDOW_BYTES
+    )
+
+
+def create_dialogue_memory(messages: list) -> DialogueMemory:
     # construct the doubly linked list data structure for messages to ensure the order:
     #
     # to achieve precise message ordering, one could either sort messages 
@@ -55,145 +228,260 @@ def create_dialogue_memory(messages: list) -> str:
     # as a result of variable datetime precision in different stores, datetime method 
     # can not be guaranteed to work all the time. 
     # so the the better approach would be to go with the linked list data structure.
-    # to sort using a doubly linked list, we must first find the last message in the dialogue.
-    # finding the last message is as easy as subtracting two unique sets: message_id and in_response_to.
-    # 
-    # i.e.
-    # MESSAGE_IDS: {A, B, C}
-    # IN_RSPNS_TO: {-, A, B}
-    # MESSAGE_IDS - IN_RSPNS_TO = {C}
-    
-    response = {}
-
-    messages = pd.DataFrame([x.__dict__ for x in messages])
-    messages.drop(["_sa_instance_state"], axis=1, inplace=True)
-    msg_ids = set(messages["id"])
-    in_response_to_ids = set(messages["in_response_to"])
-    last_msg_id = list(msg_ids - in_response_to_ids)[0]
-    response["last_message_id"] = last_msg_id
-
-    # Create the dialogue history
-    ordered_messages = []
-    counter = len(messages) -1
-    while last_msg_id is not None:
-        temp_msg_type = messages.loc[messages.id == last_msg_id]["message_type"].values[0]
-        temp_content = messages.loc[messages.id == last_msg_id]["content"].values[0]
-        ordered_messages.append(f"{temp_msg_type + " :" if counter > 0 else ""} {temp_content}")
-        last_msg_id = messages.loc[messages.id == last_msg_id]["in_response_to"].values[0]
-        counter -= 1
-    ordered_messages = list(reversed(ordered_messages))
-    
-    dialogue_memory = " \n ".join(ordered_messages)
-    response["memory"] = dialogue_memory.strip()
+    # ordering.order_messages finds the last message and walks the chain back to the head.
+    with stage("order"):
+        ordered_messages = order_messages(messages)
+
+    # Create the dialogue history, the first message already carries the initial prompt
+    return windowed_memory(ordered_messages[0].user_id, ordered_messages)
+
+
+async def load_dialogue_memory(db: AsyncSession, dialogue_id: str, user_id: str, tail_id: str = None) -> tuple:
+    # builds the memory of a dialogue from the database, returns it with the dialogue's first and last message.
+    # without a window every message is loaded and ordered here, with one the database walks the chain
+    # back from the tail and only the window plus the first message (it carries the initial prompt) are fetched.
+    not_found = HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dialogue not found or user is not permitted to read")
+    if MEMORY_WINDOW_MESSAGES <= 0 and MEMORY_WINDOW_BYTES <= 0:
+        msgs = await get_all_dialogue_messages(db=db, dialogue_id=dialogue_id, user_id=user_id)
+
+        # check if there is such a chat or the user has the right permissions to read that
+        if len(msgs) == 0:
+            raise not_found
+        memory = create_dialogue_memory(msgs)
+        first = next(msg for msg in msgs if msg.in_response_to is None)
+        last = next(msg for msg in msgs if msg.id == memory.last_message_id)
+        return memory, first, last
+
+    tail_ids = [tail_id] if tail_id is not None else await get_dialogue_tail_ids(db=db, dialogue_id=dialogue_id, user_id=user_id)
+    if len(tail_ids) == 0:
+        raise not_found
+    if len(tail_ids) > 1:
+        raise ForkedChainError("Dialogue has more than one last message")
+    window = await get_dialogue_window(
+        db=db,
+        dialogue_id=dialogue_id,
+        user_id=user_id,
+        tail_id=tail_ids[0],
+        max_messages=MEMORY_WINDOW_MESSAGES,
+        max_bytes=MEMORY_WINDOW_BYTES,
+    )
+    if len(window) == 0:
+        # a head row pointing to a message that is not there, look the tail up from the messages
+        if tail_id is not None:
+            return await load_dialogue_memory(db=db, dialogue_id=dialogue_id, user_id=user_id)
+        raise not_found
+    if len(set(msg.id for msg in window)) != len(window):
+        raise BrokenChainError("Dialogue chain contains a cycle")
+
+    first, last = window[0], window[-1]
+    if first.in_response_to is not None:
+        # the walk has to end at the head or at one of the limits, anything else is a broken chain
+        window_bytes = sum(len((msg.content or "").encode("utf-8")) for msg in window)
+        if len(window) != MEMORY_WINDOW_MESSAGES and not (0 < MEMORY_WINDOW_BYTES <= window_bytes):
+            raise BrokenChainError(f"Message {first.id} is in response to missing message {first.in_response_to}")
+        first = await get_dialogue_first_message(db=db, dialogue_id=dialogue_id, user_id=user_id)
+        if first is None:
+            raise BrokenChainError("Dialogue has no first message")
+        # the window must not start with a CHATBOT reply whose HUMAN message was left out
+        start = 0
+        while start < len(window) - 1 and window[start].message_type == SchemaMessageType.ai:
+            start += 1
+        window = [first] + window[start:]
+
+    return windowed_memory(user_id, window), first, last
+
+
+async def prepare_turn(db: AsyncSession, user_info: dict, message: str, dialogue_id: str = None) -> tuple[SchemaMessage, str]:
+    # builds the human message of a turn and the memory that is sent to the agent for it
+    # Message can not be empty since in our design a dialogue is only happening after the first message
+    if message is None or message == "":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Message is empty"
+        )
+
+    # Check if this is a new dialogue
+    if dialogue_id is None:
+        # a new dialogue
+        dialogue_id = str(uuid4())
+
+        # create augmented message = prompt + message
+        message = f"{INITIAL_PROMPT} \n\n HUMAN : {message}"
+        last_message_id = None
+        dialogue_memory = message
+    else:
+        # continuation on a previous dialogue
+
+        # a cached memory is only valid while its last message is still the tail of the dialogue
+        memory = memory_cache.get(dialogue_id, user_info["id"])
+        if DIALOGUE_HEADS:
+            # the head row knows the tail, a single primary key read
+            head = await get_dialogue(db=db, dialogue_id=dialogue_id, user_id=user_info["id"])
+            if memory is not None and (head is None or head.last_message_id != memory.last_message_id):
+                memory_cache.invalidate(dialogue_id)
+                memory = None
+        elif memory is not None and not await is_dialogue_tail(db=db, message_id=memory.last_message_id):
+            memory_cache.invalidate(dialogue_id)
+            memory = None
+
+        if memory is None:
+            if DIALOGUE_HEADS and head is not None and not await is_dialogue_tail(db=db, message_id=head.last_message_id):
+                # the head fell behind while DIALOGUE_HEADS was off, the tail is found from the messages
+                # and the head is rewritten below
+                head = None
+            try:
+                with stage("load"):
+                    memory, first, last = await load_dialogue_memory(
+                        db=db,
+                        dialogue_id=dialogue_id,
+                        user_id=user_info["id"],
+                        tail_id=head.last_message_id if DIALOGUE_HEADS and head is not None else None,
+                    )
+            except DialogueChainError as e:
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Dialogue is corrupted: {e}")
+            memory_cache.put(dialogue_id, memory)
+
+            # dialogues from before the heads were enabled, or with a stale head, get their head row now
+            if DIALOGUE_HEADS and (head is None or head.last_message_id != memory.last_message_id):
+                message_count = await count_dialogue_messages(db=db, dialogue_id=dialogue_id, user_id=user_info["id"])
+                await put_dialogue_head(db=db, head=dialogue_head_row(first, last, message_count))
+
+        # fit the history and the new message into the agent's context budget
+        last_message_id = memory.last_message_id
+        with stage("context"):
+            dialogue_memory = await assemble_context(memory, message)
+
+    # end the read transaction so the connection goes back to the pool while the agent generates
+    await db.commit()
+
+    # create a new message object, the memory itself is not stored with it
+    msg = SchemaMessage(
+        id=str(uuid4()),
+        user_id=user_info["id"],
+        dialogue_id=dialogue_id,
+        created_at=datetime.now(timezone.utc),
+        content=message,
+        message_type=SchemaMessageType.human,
+        in_response_to=last_message_id,
+    )
+    return msg, dialogue_memory
+
+
+@contextmanager
+def claim_tail(msg: SchemaMessage):
+    # one turn at a time per dialogue tail. across processes the unique index on in_response_to lets
+    # only one of two racing turns be stored; within one, the second is refused before it costs a generation
+    tail = msg.in_response_to
+    if tail is not None and tail in tails_in_flight:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Dialogue is being continued by another request")
+    if tail is not None:
+        tails_in_flight.add(tail)
+    try:
+        yield
+    finally:
+        if tail is not None:
+            tails_in_flight.discard(tail)
+
+
+async def complete_turn(msg: SchemaMessage, reply_content: SchemaAgentMessage) -> SchemaMessage:
+    # create a new message object for ai reply
+    rply = SchemaMessage(
+        id=str(uuid4()),
+        user_id=msg.user_id,
+        dialogue_id=msg.dialogue_id,
+        created_at=reply_content.created_at,
+        content=reply_content.content,
+        message_type=reply_content.message_type,
+        in_response_to=msg.id,
+    )
+
+    # store both messages in one transaction, batched with other turns by the writer
+    try:
+        with stage("write"):
+            await message_writer.write([msg, rply])
+    except IntegrityError:
+        # another turn was stored on the same tail first
+        memory_cache.invalidate(msg.dialogue_id)
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Dialogue was continued by another request, reload it and send the message again",
+        )
+    if msg.in_response_to is None:
+        memory_cache.put(msg.dialogue_id, windowed_memory(msg.user_id, [msg, rply]))
+    else:
+        memory_cache.append(msg.dialogue_id, [msg, rply])
+
+    return rply
 
-    return response
+
+async def run_turn(db: AsyncSession, user_info: dict, message: str, dialogue_id: str = None) -> dict:
+    with stage("prepare"):
+        msg, dialogue_memory = await prepare_turn(db=db, user_info=user_info, message=message, dialogue_id=dialogue_id)
+
+    with claim_tail(msg):
+        # generate a response based on the augmented message
+        with stage("agent"):
+            reply_content = await get_agent_reply(message=dialogue_memory)
+        rply = await complete_turn(msg=msg, reply_content=reply_content)
+
+    return {"memory": dialogue_memory, "reply": rply}
 
 
 @app.post("/api/v1/dialogue")
 async def dialogue(
-    message: str = None, dialogue_id: str = None, auth: str = Header(None), db: Session = Depends(get_db)
+    response: Response,
+    message: str = None,
+    dialogue_id: str = None,
+    auth: str = Header(None),
+    idempotency_key: str = Header(None),
+    db: AsyncSession = Depends(get_db),
 ):
+    # retries sent with the same Idempotency-Key get the first attempt's turn instead of a new generation:
+    # the running one while it is in flight, the stored one once it is done
     try:
-        # Simple User Info Checker
-        user_info = requests.get(AUTH_URL, headers={"Authorization": auth})
-        if user_info.status_code != 200:
-            raise HTTPException(user_info.status_code)
-
-        user_info = json.loads(user_info.content)
-        # Message can not be empty since in our design a dialogue is only happening after the first message
-        if message is None or message == "":
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST, detail="Message is empty"
-            )
-        message_id = str(uuid4())
-
-        # Check if this is a new dialogue
-        if dialogue_id is None:
-            # a new dialogue
-            dialogue_id = str(uuid4())
-
-            # create augmented message = prompt + message
-            message = f"{INITIAL_PROMPT} \n\n HUMAN : {message}"
-
-            # create a new message object for a new dialogue id
-            msg = SchemaMessage(
-                id=message_id,
-                user_id=user_info["id"],
-                dialogue_id=dialogue_id,
-                created_at=datetime.now(timezone.utc),
-                content=message,
-                message_type=SchemaMessageType.human,
-                in_response_to=None,
-            )
-
-            # generate a response based on the augmented message
-            reply_content = get_agent_reply(message=message)
-
-            # create a new message object for ai reply
-            rply = SchemaMessage(
-                id=str(uuid4()),
-                user_id=user_info["id"],
-                dialogue_id=dialogue_id,
-                created_at=reply_content.created_at,
-                content=reply_content.content,
-                message_type=reply_content.message_type,
-                in_response_to=message_id,
-            )
-
-            # store messages
-            create_message(db=db, message=msg)
-            create_message(db=db, message=rply)
+        with stage("auth"):
+            user_info = await get_user_info(auth)
+        if idempotency_key is None:
+            return await run_turn(db=db, user_info=user_info, message=message, dialogue_id=dialogue_id)
+        if len(idempotency_key) > 255:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Idempotency-Key is longer than 255 characters")
+
+        async def work():
+            # may outlive this request, so it does not use the request's session
+            async with SessionLocal() as own_db:
+                return await run_turn(db=own_db, user_info=user_info, message=message, dialogue_id=dialogue_id)
+
+        result, replayed = await idempotency_store.run(
+            user_id=user_info["id"],
+            key=idempotency_key,
+            fingerprint=request_fingerprint(dialogue_id, message),
+            work=work,
+        )
+        if replayed:
+            response.headers["Idempotent-Replayed"] = "true"
+        return result
+    except IdempotencyKeyReusedError as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Unknown error occured: {e}",
+        )
 
-            return {
-                "memory":msg.content,
-                "reply": rply
-            }
-        else:
-            # continuation on a previous dialogue
-
-            # get all dialogue messages
-            msgs = get_all_dialogue_messages(db=db, dialogue_id=dialogue_id, user_id=user_info["id"])
-            
-            # check if there is such a chat or the user has the right permissions to read that
-            if len(msgs) == 0:
-                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dialogue not found or user is not permitted to read")
-
-            # create the dialogue memory
-            memory = create_dialogue_memory(msgs)
-            last_message_id = memory["last_message_id"]
-            dialogue_memory = memory["memory"]
-            dialogue_memory += f" \n HUMAN : {message}"
-
-            # create a new message object with memory
-            msg = SchemaMessage(
-                id=message_id,
-                user_id=user_info["id"],
-                dialogue_id=dialogue_id,
-                created_at=datetime.now(timezone.utc),
-                content=message,
-                message_type=SchemaMessageType.human,
-                in_response_to=last_message_id,
-            )
-            
-            # generate a response based on the augmented message
-            reply_content = get_agent_reply(message=dialogue_memory)
-
-            # create a new message object for ai reply
-            rply = SchemaMessage(
-                id=str(uuid4()),
-                user_id=user_info["id"],
-                dialogue_id=dialogue_id,
-                created_at=reply_content.created_at,
-                content=reply_content.content,
-                message_type=reply_content.message_type,
-                in_response_to=message_id,
-            )
-
-            # store messages
-            create_message(db=db, message=msg)
-            create_message(db=db, message=rply)
-
-            return({"memory":dialogue_memory, "reply":rply})
+
+@app.post("/api/v1/dialogue/stream")
+async def dialogue_stream(
+    message: str = None, dialogue_id: str = None, auth: str = Header(None), db: AsyncSession = Depends(get_db)
+):
+    # same turn as /api/v1/dialogue, relayed to the client as NDJSON lines:
+    # {"memory", "dialogue_id"} first, then one {"token"} per generated token and
+    # finally {"reply"} once the reply is stored, or {"error"} if generation failed.
+    try:
+        with stage("auth"):
+            user_info = await get_user_info(auth)
+        with stage("prepare"):
+            msg, dialogue_memory = await prepare_turn(db=db, user_info=user_info, message=message, dialogue_id=dialogue_id)
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -202,18 +490,70 @@ async def dialogue(
             detail=f"Unknown error occured: {e}",
         )
 
+    async def relay():
+        yield json.dumps({"memory": dialogue_memory, "dialogue_id": msg.dialogue_id}) + "\n"
+        tokens = []
+        try:
+            with claim_tail(msg):
+                started = time.perf_counter()
+                async for token in stream_agent_reply(message=dialogue_memory):
+                    if len(tokens) == 0:
+                        observe(STAGE_SECONDS.labels("agent_first_token"), time.perf_counter() - started)
+                    tokens.append(token)
+                    yield json.dumps({"token": token}) + "\n"
+                observe(STAGE_SECONDS.labels("agent"), time.perf_counter() - started)
+
+                # the turn is only persisted once the whole reply has arrived
+                reply_content = SchemaAgentMessage(
+                    created_at=datetime.now(tz=timezone.utc),
+                    content="".join(tokens),
+                    message_type=SchemaMessageType.ai,
+                )
+                rply = await complete_turn(msg=msg, reply_content=reply_content)
+        except HTTPException as e:
+            yield json.dumps({"error": e.detail}) + "\n"
+            return
+        except Exception as e:
+            yield json.dumps({"error": f"Unknown error occured: {e}"}) + "\n"
+            return
+        yield json.dumps({"reply": rply.model_dump(mode="json")}) + "\n"
+
+    return StreamingResponse(relay(), media_type="application/x-ndjson")
+
 
 @app.get("/api/v1/dialogues")
-async def get_dialogues(skip:int = 0, limit:int=10, auth: str = Header(None), db: Session = Depends(get_db)):
+async def get_dialogues(cursor: str = None, skip:int = 0, limit:int=10, auth: str = Header(None), db: AsyncSession = Depends(get_db)):
+    # pass next_cursor back as cursor to get the following page, it is null on the last page.
+    # with DIALOGUE_HEADS the dialogues are sorted by recent activity and come with a summary
     try:
-        # Simple User Info Checker
-        user_info = requests.get(AUTH_URL, headers={"Authorization": auth})
-        if user_info.status_code != 200:
-            raise HTTPException(user_info.status_code)
+        user_info = await get_user_info(auth)
 
-        user_info = json.loads(user_info.content)
+        if DIALOGUE_HEADS:
+            before = decode_head_cursor(cursor) if cursor else None
+            dialogues = await get_user_dialogues(db=db, user_id=user_info["id"], before=before, skip=skip, limit=limit)
+            next_cursor = head_cursor(dialogues[-1]) if dialogues and len(dialogues) == limit else None
+            return {
+                "dialogue_ids": [dialogue.id for dialogue in dialogues],
+                "dialogues": [
+                    {
+                        "id": dialogue.id,
+                        "last_message_id": dialogue.last_message_id,
+                        "message_count": dialogue.message_count,
+                        "created_at": dialogue.created_at,
+                        "updated_at": dialogue.updated_at,
+                        "preview": dialogue.preview,
+                    }
+                    for dialogue in dialogues
+                ],
+                "next_cursor": next_cursor,
+            }
 
-        return {"dialogue_ids":[x[0] for x in get_user_dialogue_ids(db=db, user_id=user_info["id"], skip=skip, limit=limit)]}
+        after = decode_dialogue_cursor(cursor) if cursor else None
+        dialogue_ids = [x[0] for x in await get_user_dialogue_ids(db=db, user_id=user_info["id"], after=after, skip=skip, limit=limit)]
+        next_cursor = dialogue_cursor(dialogue_ids[-1]) if dialogue_ids and len(dialogue_ids) == limit else None
+        return {"dialogue_ids": dialogue_ids, "next_cursor": next_cursor}
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -223,26 +563,83 @@ async def get_dialogues(skip:int = 0, limit:int=10, auth: str = Header(None), db
         )   
 
 @app.get("/api/v1/{dialogue_id}/messages")
-async def get_messages(dialogue_id: str = None,skip:int = 0, limit:int=10, auth: str = Header(None), db: Session = Depends(get_db)):
+async def get_messages(response: Response, dialogue_id: str = None, cursor: str = None, skip:int = 0, limit:int=10, auth: str = Header(None), db: AsyncSession = Depends(get_db)):
+    # the body stays a plain list of messages, the cursor of the next page is sent in the X-Next-Cursor header
     try:
-        # Simple User Info Checker
-        user_info = requests.get(AUTH_URL, headers={"Authorization": auth})
-        if user_info.status_code != 200:
-            raise HTTPException(user_info.status_code)
+        user_info = await get_user_info(auth)
+        after = decode_message_cursor(cursor) if cursor else None
 
-        user_info = json.loads(user_info.content)
-
-        return get_dialogue_messages(
+        messages = await get_dialogue_messages(
             db=db,
             dialogue_id=dialogue_id,
             user_id=user_info["id"],
+            after=after,
             skip=skip,
             limit=limit,
         )
+        if messages and len(messages) == limit:
+            response.headers["X-Next-Cursor"] = message_cursor(messages[-1])
+        return messages
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Unknown error occured: {e}",
-        )  
+        )
+
+
+@app.get("/api/v1/export")
+async def export(format: str = "ndjson", cursor: str = None, user_id: str = None, auth: str = Header(None)):
+    # streams whole dialogues in dialogue_id order: the caller's own, or for admins every user's
+    # (or only user_id's). an interrupted ndjson export resumes with the cursor of the last line received
+    try:
+        user_info = await get_user_info(auth)
+        if format not in EXPORT_FORMATS:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Format must be one of {sorted(EXPORT_FORMATS)}")
+        if format == "parquet" and not parquet_available():
+            raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="Parquet export needs pyarrow")
+        if user_info.get("role") == "admin":
+            owner = user_id
+        elif user_id is not None and user_id != user_info["id"]:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="User is not permitted to export other users")
+        else:
+            owner = user_info["id"]
+        after = decode_dialogue_cursor(cursor) if cursor else None
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Unknown error occured: {e}",
+        )
+
+    if format == "ndjson":
+        return StreamingResponse(export_ndjson(user_id=owner, after=after), media_type="application/x-ndjson")
+    return StreamingResponse(
+        (chunk async for chunk, _ in export_parquet(user_id=owner, after=after)),
+        media_type="application/vnd.apache.parquet",
+        headers={"Content-Disposition": 'attachment; filename="dialogues.parquet"'},
+    )
+
+
+@app.get("/api/v1/pool")
+async def get_pool():
+    # database connection pool usage
+    return pool_stats()
+
+
+@app.get("/api/v1/writer")
+async def get_writer():
+    # message writer queue and batching
+    return message_writer.stats()
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics(accept: str = Header(None)):
+    # prometheus scrape endpoint: turn stages, upstream calls, pool and writer gauges
+    return metrics_response(accept)
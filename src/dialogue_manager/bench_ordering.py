@@ -0,0 +1,98 @@
+# micro-benchmark of dialogue reconstruction: the previous pandas walk against ordering.order_messages
+#
+# usage: python dialogue_manager/bench_ordering.py [--sizes 10 100 1000 10000] [--repeat 5]
+# the legacy implementation is O(n^2), expect the 10000 messages case to take a while.
+# it needs pandas, which the services no longer depend on (pip install pandas), --skip-legacy runs without it.
+import argparse
+import random
+import timeit
+from uuid import uuid4
+
+from ordering import order_messages
+
+
+class FakeMessage:
+    # mimics the attributes of an orm row, including the state attribute the legacy code drops
+    def __init__(self, id, in_response_to, message_type, content):
+        self._sa_instance_state = None
+        self.id = id
+        self.in_response_to = in_response_to
+        self.message_type = message_type
+        self.content = content
+
+
+def make_dialogue(size: int) -> list:
+    messages = []
+    previous = None
+    for i in range(size):
+        msg = FakeMessage(
+            id=str(uuid4()),
+            in_response_to=previous,
+            message_type="HUMAN" if i % 2 == 0 else "CHATBOT",
+            content=f"message number {i}",
+        )
+        messages.append(msg)
+        previous = msg.id
+    # rows come back from the database in no guaranteed chain order
+    random.shuffle(messages)
+    return messages
+
+
+def legacy_memory(messages: list) -> dict:
+    import pandas as pd
+
+    response = {}
+    messages = pd.DataFrame([x.__dict__ for x in messages])
+    messages.drop(["_sa_instance_state"], axis=1, inplace=True)
+    msg_ids = set(messages["id"])
+    in_response_to_ids = set(messages["in_response_to"])
+    last_msg_id = list(msg_ids - in_response_to_ids)[0]
+    response["last_message_id"] = last_msg_id
+
+    ordered_messages = []
+    counter = len(messages) - 1
+    # the head replies to nothing, a missing value that string columns hold as NaN rather than None
+    while not pd.isna(last_msg_id):
+        temp_msg_type = messages.loc[messages.id == last_msg_id]["message_type"].values[0]
+        temp_content = messages.loc[messages.id == last_msg_id]["content"].values[0]
+        ordered_messages.append(f"{temp_msg_type + ' :' if counter > 0 else ''} {temp_content}")
+        last_msg_id = messages.loc[messages.id == last_msg_id]["in_response_to"].values[0]
+        counter -= 1
+    ordered_messages = list(reversed(ordered_messages))
+
+    response["memory"] = " \n ".join(ordered_messages).strip()
+    return response
+
+
+def linear_memory(messages: list) -> dict:
+    ordered_messages = order_messages(messages)
+    memory = " \n ".join(
+        f"{msg.message_type + ' :' if i > 0 else ''} {msg.content}"
+        for i, msg in enumerate(ordered_messages)
+    )
+    return {"last_message_id": ordered_messages[-1].id, "memory": memory.strip()}
+
+
+def best_of(func, messages: list, repeat: int) -> float:
+    timer = timeit.Timer(lambda: func(messages))
+    return min(timer.repeat(repeat=repeat, number=1))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--skip-legacy", action="store_true", help="only time the linear walk")
+    args = parser.parse_args()
+
+    print(f"{'messages':>10} {'legacy (s)':>12} {'linear (s)':>12} {'speedup':>10}")
+    for size in args.sizes:
+        messages = make_dialogue(size)
+        linear = best_of(linear_memory, messages, args.repeat)
+        if args.skip_legacy:
+            print(f"{size:>10} {'-':>12} {linear:>12.6f} {'-':>10}")
+            continue
+        # both implementations must agree before their timings are worth comparing
+        assert legacy_memory(messages) == linear_memory(messages)
+        legacy = best_of(legacy_memory, messages, args.repeat)
+        print(f"{size:>10} {legacy:>12.6f} {linear:>12.6f} {legacy / linear:>9.1f}x")
@@ -1,14 +1,64 @@
 import os
-from sqlalchemy import URL
+from sqlalchemy import URL, make_url
 
 INITIAL_PROMPT = "As a helpful IFS therapist chatbot, your role is to guide users through a simulated IFS session in a safe and supportive manner with a few changes to the exact steps of the IFS model."
 AUTH_URL = os.getenv("AUTH_URL", "http://127.0.0.1:8080/api/v1/me")
-SQL_ALCHEMY_DATABASE_URL = URL.create(
-    drivername="postgresql",
+# a full async SQLAlchemy url in DATABASE_URL replaces the PG_* settings, e.g. sqlite+aiosqlite for benchmarks
+SQL_ALCHEMY_DATABASE_URL = make_url(os.environ["DATABASE_URL"]) if os.getenv("DATABASE_URL") else URL.create(
+    drivername="postgresql+asyncpg",
     username=os.getenv("PG_USERNAME", "postgres"),
     password=os.getenv("PG_PASSWORD", "admin"),
     host=os.getenv("PG_HOST", "127.0.0.1"),
     port=os.getenv("PG_PORT", 5432),
     database=os.getenv("PG_DATABASE", "postgres"),
 )
-AGENT_URL = os.getenv("AGENT_URL", "http://127.0.0.1:8083/api/v1/agent")
\ No newline at end of file
+# connection pool of the async engine, DB_POOL_SIZE + DB_MAX_OVERFLOW bounds concurrent connections
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))  # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))  # seconds, -1 keeps connections forever
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", 5000))  # milliseconds, 0 disables it
+# turns are written by a background writer that groups concurrent turns into one INSERT.
+# "commit" answers after the turn is committed, "enqueue" answers once it is queued and may
+# lose queued turns on a crash
+MESSAGE_DURABILITY = os.getenv("MESSAGE_DURABILITY", "commit")
+WRITER_MAX_BATCH = int(os.getenv("WRITER_MAX_BATCH", 256))  # turns per INSERT
+WRITER_MAX_PENDING = int(os.getenv("WRITER_MAX_PENDING", 1024))  # queued turns before requests wait
+WRITER_LINGER = float(os.getenv("WRITER_LINGER", 0))  # seconds to wait for more turns before a flush
+# keep a dialogues table with the last message of every dialogue, used for listing by recent
+# activity and to check a continuation's tail. run `python dialogue_manager/manage.py backfill-heads` after enabling it
+DIALOGUE_HEADS = os.getenv("DIALOGUE_HEADS", "false").lower() == "true"
+DIALOGUE_PREVIEW_LENGTH = int(os.getenv("DIALOGUE_PREVIEW_LENGTH", 120))
+# exports read EXPORT_BATCH_SIZE rows per round trip, parquet row groups hold EXPORT_ROW_GROUP_SIZE messages
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+EXPORT_ROW_GROUP_SIZE = int(os.getenv("EXPORT_ROW_GROUP_SIZE", 10000))
+# verify RS256 access tokens with the auth service's published keys instead of calling /me per request
+LOCAL_TOKEN_VERIFICATION = os.getenv("LOCAL_TOKEN_VERIFICATION", "false").lower() == "true"
+AUTH_JWKS_URL = os.getenv("AUTH_JWKS_URL", "http://127.0.0.1:8080/.well-known/jwks.json")
+JWKS_REFRESH_INTERVAL = float(os.getenv("JWKS_REFRESH_INTERVAL", 30))  # seconds
+AGENT_URL = os.getenv("AGENT_URL", "http://127.0.0.1:8083/api/v1/agent")
+AGENT_STREAM_URL = os.getenv("AGENT_STREAM_URL", "http://127.0.0.1:8083/api/v1/agent/stream")
+AGENT_TOKENIZE_URL = os.getenv("AGENT_TOKENIZE_URL", "http://127.0.0.1:8083/api/v1/agent/tokenize")
+# maximum prompt tokens sent to the agent, keep it below the model context minus MAX_TOKENS. 0 disables trimming
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 384))
+MEMORY_CACHE_SIZE = int(os.getenv("MEMORY_CACHE_SIZE", 1024))
+# POST /api/v1/dialogue responses kept for replay to retries with the same Idempotency-Key. 0 only coalesces in-flight duplicates
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 1024))
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", 600))  # seconds
+# memory window fetched from the database and kept in the cache: the first message plus the newest
+# MEMORY_WINDOW_MESSAGES messages, up to about MEMORY_WINDOW_BYTES of content. 0 for both loads whole dialogues
+MEMORY_WINDOW_MESSAGES = int(os.getenv("MEMORY_WINDOW_MESSAGES", 64))
+MEMORY_WINDOW_BYTES = int(os.getenv("MEMORY_WINDOW_BYTES", 16384))
+# /me answers cached per token, never longer than the token's own exp. 0 disables the cache
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", 60))  # seconds
+TOKEN_CACHE_NEGATIVE_TTL = float(os.getenv("TOKEN_CACHE_NEGATIVE_TTL", 10))  # seconds
+# pooled clients for the auth and agent services, timeouts in seconds
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", 5))
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", 2))
+UPSTREAM_RETRY_BACKOFF = float(os.getenv("UPSTREAM_RETRY_BACKOFF", 0.1))
+AUTH_TIMEOUT = float(os.getenv("AUTH_TIMEOUT", 5))
+AUTH_MAX_CONNECTIONS = int(os.getenv("AUTH_MAX_CONNECTIONS", 100))
+AGENT_TIMEOUT = float(os.getenv("AGENT_TIMEOUT", 130))
+AGENT_MAX_CONNECTIONS = int(os.getenv("AGENT_MAX_CONNECTIONS", 32))
\ No newline at end of file
@@ -0,0 +1,75 @@
+import httpx
+import services
+from config import AGENT_TOKENIZE_URL, CONTEXT_TOKEN_BUDGET
+from memory import DialogueMemory, MemorySegment, join_segments
+from schemas import SchemaMessageType
+
+SEPARATOR = " \n "
+BOT_ROLE = "\n CHATBOT : "
+
+# token counts of the fixed prompt pieces, asked from the agent once
+fixed_tokens = {}
+
+
+def estimate_tokens(text: str) -> int:
+    # rough llama estimate used only when the agent can not be asked
+    return len(text) // 3 + 1
+
+
+async def count_tokens(texts: list) -> tuple[list, bool]:
+    # counts come from the agent's own tokenizer so that the budget matches what llama evaluates.
+    # the second value tells whether the counts are exact and therefore worth keeping.
+    if len(texts) == 0:
+        return [], True
+    try:
+        response = await services.send(services.agent_client, "POST", AGENT_TOKENIZE_URL, json={"texts": texts})
+        if response.status_code == 200:
+            return response.json()["counts"], True
+    except httpx.HTTPError:
+        pass
+    return [estimate_tokens(text) for text in texts], False
+
+
+def select_segments(segments: list, budget: int) -> list:
+    # the head (initial prompt + first message) is always kept, then the newest segments
+    # are taken until the budget runs out. a window never starts with a CHATBOT reply
+    # whose HUMAN message was dropped.
+    head, rest = segments[0], segments[1:]
+    used = head.tokens
+    start = len(rest)
+    while start > 0 and used + rest[start - 1].tokens <= budget:
+        used += rest[start - 1].tokens
+        start -= 1
+    while start < len(rest) and start > 0 and rest[start].message_type == SchemaMessageType.ai:
+        start += 1
+    return [head] + rest[start:]
+
+
+async def assemble_context(memory: DialogueMemory, message: str) -> str:
+    human_turn = MemorySegment(text=f"HUMAN : {message}", message_type=SchemaMessageType.human)
+    segments = memory.segments + [human_turn]
+    if CONTEXT_TOKEN_BUDGET <= 0:
+        return join_segments(segments)
+
+    # only segments that were never counted cost a tokenize call, the rest is cached on the memory
+    pending = [segment for segment in segments if segment.tokens is None]
+    fixed = [SEPARATOR, BOT_ROLE] if len(fixed_tokens) == 0 else []
+    counts, exact = await count_tokens(fixed + [segment.text for segment in pending])
+    if len(fixed) > 0:
+        fixed_counts, counts = counts[:len(fixed)], counts[len(fixed):]
+        if exact:
+            fixed_tokens.update(zip(fixed, fixed_counts))
+        separator_tokens, bot_role_tokens = fixed_counts
+    else:
+        separator_tokens, bot_role_tokens = fixed_tokens[SEPARATOR], fixed_tokens[BOT_ROLE]
+    for segment, tokens in zip(pending, counts):
+        segment.tokens = tokens + separator_tokens
+
+    # the new human turn is kept no matter what, the rest of the budget goes to the history
+    budget = CONTEXT_TOKEN_BUDGET - bot_role_tokens - human_turn.tokens
+    window = select_segments(memory.segments, budget) + [human_turn]
+
+    if not exact:
+        for segment in pending:
+            segment.tokens = None
+    return join_segments(window)
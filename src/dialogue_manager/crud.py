@@ -1,54 +1,162 @@
-from sqlalchemy.orm import Session
+from datetime import datetime
+from sqlalchemy import select, insert, tuple_, exists, func, literal
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 
-from models import DBMessage
+from config import DIALOGUE_PREVIEW_LENGTH
+from models import DBMessage, DBDialogue
 from schemas import SchemaMessage
 
 
-def get_message(db: Session, message_id: str, user_id: str):
-    return (
-        db.query(DBMessage)
-        .filter(DBMessage.id == message_id)
-        .filter(DBMessage.user_id == user_id)
-        .first()
+async def get_message(db: AsyncSession, message_id: str, user_id: str):
+    result = await db.execute(
+        select(DBMessage)
+        .where(DBMessage.id == message_id)
+        .where(DBMessage.user_id == user_id)
+        .limit(1)
     )
+    return result.scalars().first()
 
 
-def get_user_dialogue_ids(db: Session, user_id: str, skip: int = 0, limit: int = 10):
-    return (
-        db.query(DBMessage.dialogue_id)
-        .filter(DBMessage.user_id == user_id)
-        .distinct(DBMessage.dialogue_id)
+async def get_user_dialogue_ids(
+    db: AsyncSession, user_id: str, after: str | None = None, skip: int = 0, limit: int = 10
+):
+    # keyset pagination: dialogue ids in order, starting after the last id of the previous page
+    query = select(DBMessage.dialogue_id).where(DBMessage.user_id == user_id)
+    if after is not None:
+        query = query.where(DBMessage.dialogue_id > after)
+    result = await db.execute(
+        query
+        .distinct()
+        .order_by(DBMessage.dialogue_id)
         .offset(skip)
         .limit(limit)
-        .all()
     )
+    return result.all()
 
 
-def get_all_dialogue_messages(db: Session, dialogue_id: str, user_id: str):
-    return (
-        db.query(DBMessage)
-        .filter(DBMessage.dialogue_id == dialogue_id)
-        .filter(DBMessage.user_id == user_id)
+async def get_all_dialogue_messages(db: AsyncSession, dialogue_id: str, user_id: str):
+    result = await db.execute(
+        select(DBMessage)
+        .where(DBMessage.dialogue_id == dialogue_id)
+        .where(DBMessage.user_id == user_id)
         .order_by(DBMessage.created_at)
-        .all()
     )
+    return result.scalars().all()
+
+
+async def get_message_reply(db: AsyncSession, message_id: str):
+    result = await db.execute(
+        select(DBMessage)
+        .where(DBMessage.in_response_to == message_id)
+        .limit(1)
+    )
+    return result.scalars().first()
+
+
+async def is_dialogue_tail(db: AsyncSession, message_id: str) -> bool:
+    # the message is stored and nothing replies to it yet
+    result = await db.execute(
+        select(
+            exists().where(DBMessage.id == message_id),
+            exists().where(DBMessage.in_response_to == message_id),
+        )
+    )
+    stored, answered = result.one()
+    return stored and not answered
+
+
+async def get_dialogue_first_message(db: AsyncSession, dialogue_id: str, user_id: str):
+    result = await db.execute(
+        select(DBMessage)
+        .where(DBMessage.user_id == user_id)
+        .where(DBMessage.dialogue_id == dialogue_id)
+        .where(DBMessage.in_response_to.is_(None))
+        .limit(1)
+    )
+    return result.scalars().first()
+
+
+async def get_dialogue_tail_ids(db: AsyncSession, dialogue_id: str, user_id: str):
+    # messages nobody replied to, more than one means the dialogue forked
+    reply = aliased(DBMessage)
+    result = await db.execute(
+        select(DBMessage.id)
+        .where(DBMessage.user_id == user_id)
+        .where(DBMessage.dialogue_id == dialogue_id)
+        .where(~exists().where(reply.in_response_to == DBMessage.id))
+        .limit(2)
+    )
+    return result.scalars().all()
 
 
-def get_dialogue_messages(
-    db: Session, dialogue_id: str, user_id: str, skip: int = 0, limit: int = 10
+async def get_dialogue_window(
+    db: AsyncSession, dialogue_id: str, user_id: str, tail_id: str, max_messages: int = 0, max_bytes: int = 0
 ):
-    return (
-        db.query(DBMessage)
-        .filter(DBMessage.dialogue_id == dialogue_id)
-        .filter(DBMessage.user_id == user_id)
-        .order_by(DBMessage.created_at)
+    # walks the in_response_to chain back from the tail inside the database with a recursive query.
+    # the walk stops at the head, after max_messages messages or once max_bytes of content were collected,
+    # and the rows come back in head to tail order.
+    content_bytes = func.coalesce(func.octet_length(DBMessage.content), 0)
+    chain = (
+        select(DBMessage.id, DBMessage.in_response_to, literal(1).label("depth"), content_bytes.label("bytes"))
+        .where(DBMessage.id == tail_id)
+        .where(DBMessage.user_id == user_id)
+        .where(DBMessage.dialogue_id == dialogue_id)
+        .cte("chain", recursive=True)
+    )
+    parent = aliased(DBMessage)
+    step = (
+        select(
+            parent.id,
+            parent.in_response_to,
+            chain.c.depth + 1,
+            chain.c.bytes + func.coalesce(func.octet_length(parent.content), 0),
+        )
+        .join(chain, parent.id == chain.c.in_response_to)
+        .where(parent.user_id == user_id)
+        .where(parent.dialogue_id == dialogue_id)
+    )
+    if max_messages > 0:
+        step = step.where(chain.c.depth < max_messages)
+    if max_bytes > 0:
+        step = step.where(chain.c.bytes < max_bytes)
+    chain = chain.union_all(step)
+
+    result = await db.execute(
+        select(DBMessage)
+        .join(chain, DBMessage.id == chain.c.id)
+        .order_by(chain.c.depth.desc())
+    )
+    return result.scalars().all()
+
+
+async def get_dialogue_messages(
+    db: AsyncSession,
+    dialogue_id: str,
+    user_id: str,
+    after: tuple[datetime, str] | None = None,
+    skip: int = 0,
+    limit: int = 10,
+):
+    # keyset pagination on (created_at, id), the id breaks ties between messages created at the same time
+    query = (
+        select(DBMessage)
+        .where(DBMessage.user_id == user_id)
+        .where(DBMessage.dialogue_id == dialogue_id)
+    )
+    if after is not None:
+        query = query.where(tuple_(DBMessage.created_at, DBMessage.id) > tuple_(*after))
+    result = await db.execute(
+        query
+        .order_by(DBMessage.created_at, DBMessage.id)
         .offset(skip)
         .limit(limit)
-        .all()
     )
+    return result.scalars().all()
 
 
-def create_message(db: Session, message: SchemaMessage):
+async def create_message(db: AsyncSession, message: SchemaMessage):
     db_message = DBMessage(
         id=message.id,
         user_id=message.user_id,
@@ -59,11 +167,122 @@ def create_message(db: Session, message: SchemaMessage):
         in_response_to=message.in_response_to,
     )
     db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
+    await db.commit()
+    await db.refresh(db_message)
 
 
+async def create_messages(db: AsyncSession, messages: list[SchemaMessage]):
+    # one multi-row INSERT for any number of messages, committed by the caller
+    await db.execute(
+        insert(DBMessage),
+        [
+            {
+                "id": message.id,
+                "user_id": message.user_id,
+                "dialogue_id": message.dialogue_id,
+                "created_at": message.created_at,
+                "content": message.content,
+                "message_type": message.message_type.value,
+                "in_response_to": message.in_response_to,
+            }
+            for message in messages
+        ],
+    )
+
+
+async def get_dialogue(db: AsyncSession, dialogue_id: str, user_id: str):
+    result = await db.execute(
+        select(DBDialogue)
+        .where(DBDialogue.id == dialogue_id)
+        .where(DBDialogue.user_id == user_id)
+    )
+    return result.scalars().first()
+
+
+async def get_user_dialogues(
+    db: AsyncSession, user_id: str, before: tuple[datetime, str] | None = None, skip: int = 0, limit: int = 10
+):
+    # most recently active first, keyset paginated on (updated_at, id)
+    query = select(DBDialogue).where(DBDialogue.user_id == user_id)
+    if before is not None:
+        query = query.where(tuple_(DBDialogue.updated_at, DBDialogue.id) < tuple_(*before))
+    result = await db.execute(
+        query
+        .order_by(DBDialogue.updated_at.desc(), DBDialogue.id.desc())
+        .offset(skip)
+        .limit(limit)
+    )
+    return result.scalars().all()
+
+
+def dialogue_head_row(first, last, message_count: int) -> dict:
+    return {
+        "id": first.dialogue_id,
+        "user_id": first.user_id,
+        "first_message_id": first.id,
+        "last_message_id": last.id,
+        "message_count": message_count,
+        "created_at": first.created_at,
+        "updated_at": last.created_at,
+        "preview": (last.content or "")[:DIALOGUE_PREVIEW_LENGTH],
+    }
+
+
+def dialogue_head_rows(messages: list) -> list[dict]:
+    # one summary row per dialogue from messages given in chain order
+    dialogues = {}
+    for message in messages:
+        dialogues.setdefault(message.dialogue_id, []).append(message)
+    return [dialogue_head_row(msgs[0], msgs[-1], len(msgs)) for msgs in dialogues.values()]
+
+
+def upsert(db: AsyncSession, table):
+    # INSERT .. ON CONFLICT in the dialect of the session's database
+    if db.bind.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+        return sqlite_insert(table)
+    return pg_insert(table)
+
+
+async def update_dialogue_heads(db: AsyncSession, messages: list):
+    # new messages move each dialogue's tail forward, part of the transaction inserting them
+    statement = upsert(db, DBDialogue).values(dialogue_head_rows(messages))
+    statement = statement.on_conflict_do_update(
+        index_elements=[DBDialogue.id],
+        set_={
+            "last_message_id": statement.excluded.last_message_id,
+            "message_count": DBDialogue.message_count + statement.excluded.message_count,
+            "updated_at": statement.excluded.updated_at,
+            "preview": statement.excluded.preview,
+        },
+    )
+    await db.execute(statement)
+
+
+async def put_dialogue_head(db: AsyncSession, head: dict):
+    # rewrites a dialogue's head row, unless the stored head already counts more messages
+    # (a turn was written in the meantime)
+    statement = upsert(db, DBDialogue).values(head)
+    statement = statement.on_conflict_do_update(
+        index_elements=[DBDialogue.id],
+        set_={column: statement.excluded[column] for column in head if column != "id"},
+        where=DBDialogue.message_count <= statement.excluded.message_count,
+    )
+    await db.execute(statement)
+
+
+async def count_dialogue_messages(db: AsyncSession, dialogue_id: str, user_id: str) -> int:
+    result = await db.execute(
+        select(func.count())
+        .select_from(DBMessage)
+        .where(DBMessage.user_id == user_id)
+        .where(DBMessage.dialogue_id == dialogue_id)
+    )
+    return result.scalar()
+
 if __name__ == "__main__":
+    import asyncio
     from datetime import datetime, timezone
     from schemas import SchemaMessageType
 
@@ -79,19 +298,23 @@ if __name__ == "__main__":
     # print(msg)
     # print(msg.user_id)
 
-    from models import Base
+    from models import create_schema
     from database import SessionLocal, engine
 
-    Base.metadata.create_all(bind=engine)
-    db = SessionLocal()
-    # create_message(db=db, message=msg)
-
-    print(
-        get_dialogue_messages(
-            db=db,
-            dialogue_id="b69dfb2e-e1c9-48f0-879a-f1243c0d58ef",
-            user_id="c85f5866-852e-40d8-a4f2-2dada07c7708",
-            skip=0,
-            limit=10,
-        )
-    )
+    async def main():
+        async with engine.begin() as conn:
+            await conn.run_sync(create_schema)
+        async with SessionLocal() as db:
+            # await create_message(db=db, message=msg)
+
+            print(
+                await get_dialogue_messages(
+                    db=db,
+                    dialogue_id="b69dfb2e-e1c9-48f0-879a-f1243c0d58ef",
+                    user_id="c85f5866-852e-40d8-a4f2-2dada07c7708",
+                    skip=0,
+                    limit=10,
+                )
+            )
+
+    asyncio.run(main())
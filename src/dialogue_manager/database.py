@@ -1,10 +1,63 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from config import SQL_ALCHEMY_DATABASE_URL
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import declarative_base
+from config import (
+    SQL_ALCHEMY_DATABASE_URL,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING,
+    DB_STATEMENT_TIMEOUT,
+)
 
-engine = create_engine(SQL_ALCHEMY_DATABASE_URL)
+# the statement timeout is enforced by postgres itself, so a slow query frees its connection
+# instead of holding it until the client gives up
+connect_args = {}
+if DB_STATEMENT_TIMEOUT > 0 and SQL_ALCHEMY_DATABASE_URL.drivername.startswith("postgresql"):
+    connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT)}
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+engine = create_async_engine(
+    SQL_ALCHEMY_DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=DB_POOL_PRE_PING,
+    connect_args=connect_args,
+)
+
+# objects stay usable after commit, handlers read them back while building the response
+SessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
+
+pool_counters = {"connects": 0, "checkouts": 0, "invalidations": 0}
+
+
+@event.listens_for(engine.sync_engine, "connect")
+def count_connect(dbapi_connection, connection_record):
+    pool_counters["connects"] += 1
+
+
+@event.listens_for(engine.sync_engine, "checkout")
+def count_checkout(dbapi_connection, connection_record, connection_proxy):
+    pool_counters["checkouts"] += 1
+
+
+@event.listens_for(engine.sync_engine, "invalidate")
+def count_invalidate(dbapi_connection, connection_record, exception):
+    # pre-ping failures and connections dropped by the server
+    pool_counters["invalidations"] += 1
+
+
+def pool_stats() -> dict:
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "max_overflow": DB_MAX_OVERFLOW,
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        **pool_counters,
+    }
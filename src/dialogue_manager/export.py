@@ -0,0 +1,156 @@
+import importlib.util
+import io
+import logging
+from typing import AsyncIterator
+import ujson as json
+from sqlalchemy import select, text
+from database import SessionLocal
+from models import DBMessage
+from ordering import DialogueChainError, order_messages
+from pagination import dialogue_cursor
+from config import EXPORT_BATCH_SIZE, EXPORT_ROW_GROUP_SIZE
+
+logger = logging.getLogger("uvicorn.error")
+
+EXPORT_FORMATS = {"ndjson", "parquet"}
+
+
+def parquet_available() -> bool:
+    # pyarrow is not part of requirements.txt, install it where parquet exports are needed
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def message_record(message: DBMessage, position: int) -> dict:
+    return {
+        "id": message.id,
+        "user_id": message.user_id,
+        "dialogue_id": message.dialogue_id,
+        "position": position,
+        "created_at": message.created_at,
+        "content": message.content,
+        "message_type": message.message_type,
+        "in_response_to": message.in_response_to,
+    }
+
+
+async def iter_dialogues(user_id: str | None = None, after: str | None = None) -> AsyncIterator[tuple[str, list]]:
+    # streams whole dialogues in dialogue_id order through a server-side cursor, EXPORT_BATCH_SIZE rows
+    # at a time, so memory holds one batch and one dialogue whatever the size of the table.
+    # yields (dialogue_id, messages in chain order); a corrupted dialogue yields its error instead of messages.
+    query = select(DBMessage)
+    if user_id is not None:
+        query = query.where(DBMessage.user_id == user_id)
+    if after is not None:
+        query = query.where(DBMessage.dialogue_id > after)
+    query = query.order_by(DBMessage.dialogue_id, DBMessage.created_at, DBMessage.id)
+
+    async with SessionLocal() as db:
+        if db.bind.dialect.name == "postgresql":
+            # an export runs far longer than any request, the statement timeout is for the latter
+            await db.execute(text("SET LOCAL statement_timeout = 0"))
+        result = await db.stream(query.execution_options(yield_per=EXPORT_BATCH_SIZE))
+
+        dialogue_id, messages = None, []
+        async for message in result.scalars():
+            if message.dialogue_id != dialogue_id and len(messages) > 0:
+                yield dialogue_id, order_dialogue(dialogue_id, messages)
+                messages = []
+            dialogue_id = message.dialogue_id
+            messages.append(message)
+            # rows are only read, nothing has to stay in the identity map
+            db.expunge(message)
+        if len(messages) > 0:
+            yield dialogue_id, order_dialogue(dialogue_id, messages)
+
+
+def order_dialogue(dialogue_id: str, messages: list) -> list | DialogueChainError:
+    try:
+        return order_messages(messages)
+    except DialogueChainError as e:
+        logger.warning("Exporting dialogue %s failed: %s", dialogue_id, e)
+        return e
+
+
+async def export_ndjson(user_id: str | None = None, after: str | None = None) -> AsyncIterator[str]:
+    # one line per dialogue with its messages in order and the cursor that resumes right after it
+    async for dialogue_id, messages in iter_dialogues(user_id=user_id, after=after):
+        line = {"dialogue_id": dialogue_id, "cursor": dialogue_cursor(dialogue_id)}
+        if isinstance(messages, DialogueChainError):
+            line["error"] = str(messages)
+        else:
+            line["user_id"] = messages[0].user_id
+            line["messages"] = [
+                {**message_record(message, position), "created_at": message.created_at.isoformat()}
+                for position, message in enumerate(messages)
+            ]
+        yield json.dumps(line) + "\n"
+
+
+class ChunkSink(io.RawIOBase):
+    # write-only file that hands out what was written so far. the position keeps counting across
+    # chunks since the parquet footer refers to absolute offsets
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def take(self) -> bytes:
+        chunk = b"".join(self.chunks)
+        self.chunks = []
+        return chunk
+
+
+def parquet_schema():
+    import pyarrow as pa
+
+    return pa.schema(
+        [
+            ("id", pa.string()),
+            ("user_id", pa.string()),
+            ("dialogue_id", pa.string()),
+            ("position", pa.int32()),
+            ("created_at", pa.timestamp("us", tz="UTC")),
+            ("content", pa.string()),
+            ("message_type", pa.string()),
+            ("in_response_to", pa.string()),
+        ]
+    )
+
+
+async def export_parquet(user_id: str | None = None, after: str | None = None) -> AsyncIterator[tuple[bytes, str | None]]:
+    # one message per row, written in row groups of EXPORT_ROW_GROUP_SIZE rows that are handed out as
+    # soon as they are encoded, together with the cursor after the last dialogue they hold.
+    # corrupted dialogues are left out.
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = parquet_schema()
+    sink = ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    rows = []
+    cursor = None
+
+    async for dialogue_id, messages in iter_dialogues(user_id=user_id, after=after):
+        cursor = dialogue_cursor(dialogue_id)
+        if isinstance(messages, DialogueChainError):
+            continue
+        rows.extend(message_record(message, position) for position, message in enumerate(messages))
+        if len(rows) >= EXPORT_ROW_GROUP_SIZE:
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+            rows.clear()
+            yield sink.take(), cursor
+
+    if len(rows) > 0:
+        writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+    writer.close()
+    yield sink.take(), cursor
@@ -0,0 +1,82 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+
+class IdempotencyKeyReusedError(Exception):
+    pass
+
+
+def request_fingerprint(*parts) -> str:
+    # a key stands for one request, reusing it with other parameters is a client error
+    return hashlib.sha256("\x00".join("" if part is None else str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+class IdempotencyStore:
+    # results of requests sent with an Idempotency-Key, scoped per user. a duplicate that arrives while
+    # the first request is still running waits for its result instead of starting the work again, one
+    # that arrives later gets the stored result replayed. completed results are kept for ttl seconds,
+    # at most max_size of them (LRU). failures are not kept, the request can be retried.
+    # the store is per process: a retry that lands on another replica runs again.
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.replayed = 0
+        self.coalesced = 0
+        self.executed = 0
+        self._completed = OrderedDict()
+        self._in_flight = {}
+
+    async def run(self, user_id: str, key: str, fingerprint: str, work: Callable[[], Awaitable]) -> tuple:
+        # returns (result, replayed). the work runs as its own task, so a first request whose client
+        # gave up (the usual reason for a retry) still finishes and its result is there for the retry
+        scope = (user_id, key)
+
+        entry = self._completed.get(scope)
+        if entry is not None:
+            expires_at, stored_fingerprint, result = entry
+            if expires_at > time.monotonic():
+                self._check(stored_fingerprint, fingerprint)
+                self._completed.move_to_end(scope)
+                self.replayed += 1
+                return result, True
+            del self._completed[scope]
+
+        in_flight = self._in_flight.get(scope)
+        if in_flight is not None:
+            stored_fingerprint, task = in_flight
+            self._check(stored_fingerprint, fingerprint)
+            self.coalesced += 1
+            return await asyncio.shield(task), True
+
+        task = asyncio.create_task(work())
+        self._in_flight[scope] = (fingerprint, task)
+        task.add_done_callback(lambda task: self._finish(scope, fingerprint, task))
+        self.executed += 1
+        return await asyncio.shield(task), False
+
+    @staticmethod
+    def _check(stored_fingerprint: str, fingerprint: str):
+        if stored_fingerprint != fingerprint:
+            raise IdempotencyKeyReusedError("Idempotency-Key was already used for a different request")
+
+    def _finish(self, scope: tuple, fingerprint: str, task: asyncio.Task):
+        self._in_flight.pop(scope, None)
+        if task.cancelled() or task.exception() is not None or self.max_size <= 0:
+            return
+        self._completed[scope] = (time.monotonic() + self.ttl, fingerprint, task.result())
+        self._completed.move_to_end(scope)
+        while len(self._completed) > self.max_size:
+            self._completed.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._completed),
+            "max_size": self.max_size,
+            "in_flight": len(self._in_flight),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "replayed": self.replayed,
+        }
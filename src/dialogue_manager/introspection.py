@@ -0,0 +1,73 @@
+import base64
+import hashlib
+import time
+from collections import OrderedDict
+from threading import Lock
+
+import ujson as json
+
+# auth answers that say the token itself is bad, worth remembering for a short while
+INVALID_TOKEN_STATUSES = {401, 403, 404}
+
+
+def token_expiry(auth: str) -> float | None:
+    # reads the exp claim without verifying the signature. it is only used to make sure a cached
+    # answer never outlives the token, the token itself was already verified by the auth service.
+    try:
+        payload = auth.split(" ")[-1].split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenIntrospectionCache:
+    # bounded, LRU-evicted cache of /me answers keyed by a hash of the Authorization header.
+    # valid tokens map to the user info and expire after ttl or at the token's exp, whichever is first;
+    # invalid tokens map to the auth status code and expire after negative_ttl.
+    def __init__(self, max_size: int, ttl: float, negative_ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    @staticmethod
+    def key(auth: str) -> str:
+        return hashlib.sha256(auth.encode("utf-8")).hexdigest()
+
+    def get(self, auth: str) -> tuple | None:
+        # returns (status_code, user_info), user_info is None for an invalid token
+        with self._lock:
+            key = self.key(auth)
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.time():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], entry[2]
+
+    def put(self, auth: str, user_info: dict):
+        expires_at = time.time() + self.ttl
+        exp = token_expiry(auth)
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        self._store(auth, expires_at, 200, user_info)
+
+    def put_invalid(self, auth: str, status_code: int):
+        if status_code in INVALID_TOKEN_STATUSES:
+            self._store(auth, time.time() + self.negative_ttl, status_code, None)
+
+    def _store(self, auth: str, expires_at: float, status_code: int, user_info: dict | None):
+        if self.max_size <= 0 or expires_at <= time.time():
+            return
+        with self._lock:
+            key = self.key(auth)
+            self._entries[key] = (expires_at, status_code, user_info)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
@@ -0,0 +1,116 @@
+import argparse
+import asyncio
+import sys
+from sqlalchemy import select, tuple_
+from database import SessionLocal, engine
+from models import DBMessage, create_schema
+from crud import get_all_dialogue_messages, put_dialogue_head, dialogue_head_row
+from ordering import DialogueChainError, order_messages
+from pagination import decode_dialogue_cursor
+from export import export_ndjson, export_parquet
+
+
+async def migrate(allow_forks: bool = False) -> int:
+    # creates missing tables and indexes, run once before starting (new versions of) the service.
+    # returns the exit status: without ux_messages_in_response_to nothing stops two replicas from
+    # forking a dialogue, so that fails the migration unless allow_forks accepts it
+    async with engine.begin() as conn:
+        skipped = await conn.run_sync(create_schema)
+    await engine.dispose()
+    if not skipped:
+        print("schema is up to date")
+        return 0
+    print(
+        f"schema created except {', '.join(skipped)}: existing dialogues are forked (a message has several replies). "
+        "concurrent turns on one dialogue are only refused within a process until the forks are removed "
+        "and migrate is run again",
+        file=sys.stderr,
+    )
+    return 0 if allow_forks else 1
+
+
+async def backfill_heads(batch_size: int):
+    # (re)builds the dialogues table from the messages, safe to run while the service is up
+    async with engine.begin() as conn:
+        await conn.run_sync(create_schema)
+
+    # batches walk (user_id, dialogue_id) in the order of ix_messages_user_dialogue_created,
+    # so each one is a range scan of that index starting after the previous batch
+    after = ("", "")
+    written = 0
+    failed = 0
+    while True:
+        async with SessionLocal() as db:
+            dialogues = (
+                await db.execute(
+                    select(DBMessage.user_id, DBMessage.dialogue_id)
+                    .where(tuple_(DBMessage.user_id, DBMessage.dialogue_id) > tuple_(*after))
+                    .distinct()
+                    .order_by(DBMessage.user_id, DBMessage.dialogue_id)
+                    .limit(batch_size)
+                )
+            ).all()
+            if len(dialogues) == 0:
+                break
+            for user_id, dialogue_id in dialogues:
+                msgs = await get_all_dialogue_messages(db=db, dialogue_id=dialogue_id, user_id=user_id)
+                try:
+                    ordered = order_messages(msgs)
+                    await put_dialogue_head(db=db, head=dialogue_head_row(ordered[0], ordered[-1], len(ordered)))
+                    written += 1
+                except DialogueChainError as e:
+                    print(f"skipped dialogue {dialogue_id}: {e}")
+                    failed += 1
+            await db.commit()
+            after = tuple(dialogues[-1])
+        print(f"{written} dialogue heads written, {failed} skipped")
+
+    await engine.dispose()
+
+
+async def export(format: str, output: str, user_id: str | None, cursor: str | None):
+    # writes the export to a file or stdout, the resume cursor goes to stderr. an interrupted
+    # parquet file is unreadable, resuming starts a new file from the last cursor printed
+    after = decode_dialogue_cursor(cursor) if cursor else None
+    out = sys.stdout.buffer if output == "-" else open(output, "wb")
+    try:
+        if format == "ndjson":
+            async for line in export_ndjson(user_id=user_id, after=after):
+                out.write(line.encode("utf-8"))
+        else:
+            async for chunk, next_cursor in export_parquet(user_id=user_id, after=after):
+                out.write(chunk)
+                out.flush()
+                if next_cursor is not None:
+                    print(f"written up to cursor {next_cursor}", file=sys.stderr)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dialogue manager maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = commands.add_parser("migrate", help="create missing tables and indexes")
+    migrate_parser.add_argument(
+        "--allow-forks", action="store_true", help="succeed even if forked dialogues prevent the unique reply index"
+    )
+
+    backfill_parser = commands.add_parser("backfill-heads", help="build the dialogues table from existing messages")
+    backfill_parser.add_argument("--batch-size", type=int, default=500)
+
+    export_parser = commands.add_parser("export", help="export dialogues as ndjson or parquet")
+    export_parser.add_argument("--format", choices=["ndjson", "parquet"], default="ndjson")
+    export_parser.add_argument("--output", default="-", help="file to write, - for stdout")
+    export_parser.add_argument("--user-id", default=None, help="only this user's dialogues")
+    export_parser.add_argument("--cursor", default=None, help="resume after this cursor")
+
+    args = parser.parse_args()
+    if args.command == "migrate":
+        sys.exit(asyncio.run(migrate(allow_forks=args.allow_forks)))
+    elif args.command == "backfill-heads":
+        asyncio.run(backfill_heads(batch_size=args.batch_size))
+    elif args.command == "export":
+        asyncio.run(export(format=args.format, output=args.output, user_id=args.user_id, cursor=args.cursor))
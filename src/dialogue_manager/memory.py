@@ -0,0 +1,108 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Any
+
+from schemas import SchemaMessageType
+
+
+def render_message(message: Any, is_head: bool) -> str:
+    # the first message of a dialogue already carries the initial prompt and its own HUMAN role
+    if is_head:
+        return f" {message.content}"
+    return f"{SchemaMessageType(message.message_type).value} : {message.content}"
+
+
+def join_segments(segments: list) -> str:
+    return " \n ".join(segment.text for segment in segments).strip()
+
+
+class MemorySegment:
+    def __init__(self, text: str, message_type: SchemaMessageType):
+        self.text = text
+        self.message_type = message_type
+        # agent token count of the text, filled in lazily by the context assembly
+        self.tokens = None
+
+
+class DialogueMemory:
+    # rendered memory of a single dialogue, kept as one segment per message
+    # so that a new turn is an append rather than a rebuild of the whole string.
+    # with a window, only the head plus the newest max_messages messages within max_bytes are kept
+    def __init__(self, user_id: str, messages: list, max_messages: int = 0, max_bytes: int = 0):
+        self.user_id = user_id
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.segments = []
+        self.last_message_id = None
+        self.extend(messages)
+
+    def extend(self, messages: list):
+        for message in messages:
+            self.segments.append(
+                MemorySegment(
+                    text=render_message(message, is_head=len(self.segments) == 0),
+                    message_type=SchemaMessageType(message.message_type),
+                )
+            )
+            self.last_message_id = message.id
+        self.trim()
+
+    def trim(self):
+        # the oldest messages after the head go first, the newest one always stays.
+        # a window never starts with a CHATBOT reply whose HUMAN message was dropped
+        trimmed = False
+        size = sum(len(segment.text.encode("utf-8")) for segment in self.segments[1:])
+        while len(self.segments) > 2 and (
+            (self.max_messages > 0 and len(self.segments) - 1 > self.max_messages)
+            or (self.max_bytes > 0 and size > self.max_bytes)
+        ):
+            size -= len(self.segments.pop(1).text.encode("utf-8"))
+            trimmed = True
+        while trimmed and len(self.segments) > 2 and self.segments[1].message_type == SchemaMessageType.ai:
+            self.segments.pop(1)
+
+    @property
+    def memory(self) -> str:
+        return join_segments(self.segments)
+
+
+class DialogueMemoryCache:
+    # bounded, LRU-evicted dialogue_id -> DialogueMemory map
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, dialogue_id: str, user_id: str) -> DialogueMemory | None:
+        with self._lock:
+            entry = self._entries.get(dialogue_id)
+            if entry is None or entry.user_id != user_id:
+                return None
+            self._entries.move_to_end(dialogue_id)
+            return entry
+
+    def put(self, dialogue_id: str, entry: DialogueMemory):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[dialogue_id] = entry
+            self._entries.move_to_end(dialogue_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def append(self, dialogue_id: str, messages: list):
+        # the new messages must continue the cached chain, otherwise another turn got in
+        # between and the entry is dropped so that the next turn rebuilds it from the database
+        with self._lock:
+            entry = self._entries.get(dialogue_id)
+            if entry is None:
+                return
+            if messages[0].in_response_to != entry.last_message_id:
+                del self._entries[dialogue_id]
+                return
+            entry.extend(messages)
+            self._entries.move_to_end(dialogue_id)
+
+    def invalidate(self, dialogue_id: str):
+        with self._lock:
+            self._entries.pop(dialogue_id, None)
@@ -0,0 +1,36 @@
+import time
+from contextlib import contextmanager
+from prometheus_client import Histogram, Counter
+from common.metrics import (
+    REQUEST_ID_HEADER,
+    REQUEST_SECONDS,
+    RequestMetricsMiddleware,
+    metrics_response,
+    observe,
+    register_stats,
+    request_id,
+)
+
+STAGE_SECONDS = Histogram(
+    "dialogue_stage_seconds",
+    "Time spent in each stage of a dialogue turn",
+    ["stage"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+UPSTREAM_SECONDS = Histogram(
+    "upstream_request_duration_seconds", "Time of one attempt at a request to the auth or agent service", ["upstream", "status"]
+)
+UPSTREAM_RETRIED = Counter("upstream_retries", "Requests to the auth or agent service that were sent again", ["upstream"])
+WRITER_FLUSH_SECONDS = Histogram("writer_flush_duration_seconds", "Time to insert and commit one batch of turns")
+WRITER_BATCH_PAIRS = Histogram(
+    "writer_batch_pairs", "Turns written per batch", buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+
+
+@contextmanager
+def stage(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(STAGE_SECONDS.labels(name), time.perf_counter() - started)
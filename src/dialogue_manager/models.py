@@ -1,13 +1,83 @@
-from sqlalchemy import Column, String, Integer, DateTime, Text
+import logging
+from sqlalchemy import Column, String, Integer, DateTime, Text, Index, MetaData
+from sqlalchemy.exc import IntegrityError
 from database import Base
 
+logger = logging.getLogger("uvicorn.error")
+
 class DBMessage(Base):
     __tablename__ = "messages"
 
     id = Column(String, primary_key=True, index=True)
-    user_id = Column(String, nullable=False, index=True)
-    dialogue_id = Column(String, nullable=False, index=True)
+    user_id = Column(String, nullable=False)
+    dialogue_id = Column(String, nullable=False)
     created_at = Column(DateTime(timezone=True), nullable=False)
     content = Column(Text) 
     message_type = Column(String, nullable=False)
-    in_response_to = Column(String, nullable=True, index=True)
+    in_response_to = Column(String, nullable=True)
+
+    # serves both listings in key order: a user's dialogue ids and a dialogue's messages by (created_at, id),
+    # so a page after a cursor is an index range scan whatever page it is.
+    # the export of all users reads every dialogue in the same key order without a user to lead with.
+    # a message has at most one reply, so two turns racing to continue the same tail can not both be stored
+    __table_args__ = (
+        Index("ix_messages_user_dialogue_created", "user_id", "dialogue_id", "created_at", "id"),
+        Index("ix_messages_dialogue_created", "dialogue_id", "created_at", "id"),
+        Index("ux_messages_in_response_to", "in_response_to", unique=True),
+    )
+
+
+
+class DBDialogue(Base):
+    # one summary row per dialogue, written in the same transaction as its messages.
+    # only maintained when DIALOGUE_HEADS is enabled
+    __tablename__ = "dialogues"
+
+    id = Column(String, primary_key=True)
+    user_id = Column(String, nullable=False)
+    first_message_id = Column(String, nullable=False)
+    last_message_id = Column(String, nullable=False)
+    message_count = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    updated_at = Column(DateTime(timezone=True), nullable=False)
+    preview = Column(Text)
+
+    # a user's dialogues by recent activity
+    __table_args__ = (
+        Index("ix_dialogues_user_updated", "user_id", "updated_at", "id"),
+    )
+
+
+def fallback_index(index: Index) -> Index:
+    # non-unique twin of a unique index, so lookups on its columns stay index scans while it is missing.
+    # it is bound to a copy of the table, create_all never creates it next to the unique one
+    table = index.table.to_metadata(MetaData())
+    return Index(index.name.replace("ux_", "ix_", 1), *(table.c[column.name] for column in index.columns))
+
+
+def create_schema(connection) -> list:
+    # create_all skips tables that already exist, so indexes added later are created one by one.
+    # returns the names of unique indexes that could not be created, their fallback index is there instead
+    skipped = []
+    Base.metadata.create_all(bind=connection)
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            if not index.unique:
+                index.create(bind=connection, checkfirst=True)
+                continue
+            # existing rows may already break a unique index (dialogues forked before it existed),
+            # the rest of the schema is created anyway
+            fallback = fallback_index(index)
+            try:
+                with connection.begin_nested():
+                    index.create(bind=connection, checkfirst=True)
+            except IntegrityError as e:
+                logger.warning(
+                    "Could not create %s, existing rows violate it, created %s instead: %s",
+                    index.name, fallback.name, e.orig,
+                )
+                fallback.create(bind=connection, checkfirst=True)
+                skipped.append(index.name)
+            else:
+                fallback.drop(bind=connection, checkfirst=True)
+    return skipped
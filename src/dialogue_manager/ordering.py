@@ -0,0 +1,76 @@
+from typing import Any, Iterable
+
+
+class DialogueChainError(Exception):
+    pass
+
+
+class BrokenChainError(DialogueChainError):
+    pass
+
+
+class ForkedChainError(DialogueChainError):
+    pass
+
+
+def index_messages(messages: Iterable[Any]) -> dict:
+    # id -> message index, so every hop of the linked list is a single dict lookup
+    index = {}
+    for msg in messages:
+        if msg.id in index:
+            raise ForkedChainError(f"Duplicate message id {msg.id}")
+        index[msg.id] = msg
+    return index
+
+
+def find_tail(index: dict) -> str:
+    # the last message is the only one that no other message is in response to:
+    #
+    # MESSAGE_IDS: {A, B, C}
+    # IN_RSPNS_TO: {-, A, B}
+    # MESSAGE_IDS - IN_RSPNS_TO = {C}
+    #
+    # a message being answered twice means two branches grew from the same parent,
+    # and a reply to a message that is not in the index means the chain is broken
+    referenced = set()
+    for msg in index.values():
+        if msg.in_response_to is None:
+            continue
+        if msg.in_response_to not in index:
+            raise BrokenChainError(f"Message {msg.id} is in response to missing message {msg.in_response_to}")
+        if msg.in_response_to in referenced:
+            raise ForkedChainError(f"Message {msg.in_response_to} has more than one reply")
+        referenced.add(msg.in_response_to)
+
+    tails = [msg_id for msg_id in index if msg_id not in referenced]
+    if len(tails) == 0:
+        raise BrokenChainError("Dialogue has no last message (cyclic chain)")
+    if len(tails) > 1:
+        raise ForkedChainError(f"Dialogue has {len(tails)} last messages")
+    return tails[0]
+
+
+def order_messages(messages: Iterable[Any]) -> list:
+    # walk the chain from tail to head in O(n) and return it in head to tail order.
+    # any message that can not be reached from the tail and any loop in the chain
+    # is reported instead of silently producing a partial memory.
+    index = index_messages(messages)
+    if len(index) == 0:
+        return []
+
+    ordered = []
+    msg_id = find_tail(index)
+    while msg_id is not None:
+        msg = index[msg_id]
+        ordered.append(msg)
+        if len(ordered) > len(index):
+            raise BrokenChainError("Dialogue chain contains a cycle")
+        msg_id = msg.in_response_to
+
+    if len(ordered) != len(index):
+        raise BrokenChainError(
+            f"{len(index) - len(ordered)} messages are not reachable from the last message"
+        )
+
+    ordered.reverse()
+    return ordered
@@ -0,0 +1,59 @@
+import base64
+import binascii
+import ujson as json
+from datetime import datetime
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+# cursors are opaque to clients: the key of the last row of a page, base64 encoded json
+
+def encode_cursor(values: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursorError("Invalid cursor")
+    if not isinstance(values, dict):
+        raise InvalidCursorError("Invalid cursor")
+    return values
+
+
+def dialogue_cursor(dialogue_id: str) -> str:
+    return encode_cursor({"dialogue_id": dialogue_id})
+
+
+def decode_dialogue_cursor(cursor: str) -> str:
+    values = decode_cursor(cursor)
+    if not isinstance(values.get("dialogue_id"), str):
+        raise InvalidCursorError("Invalid cursor")
+    return values["dialogue_id"]
+
+
+def head_cursor(dialogue) -> str:
+    return encode_cursor({"updated_at": dialogue.updated_at.isoformat(), "id": dialogue.id})
+
+
+def decode_head_cursor(cursor: str) -> tuple[datetime, str]:
+    values = decode_cursor(cursor)
+    try:
+        return datetime.fromisoformat(values["updated_at"]), str(values["id"])
+    except (KeyError, TypeError, ValueError):
+        raise InvalidCursorError("Invalid cursor")
+
+
+def message_cursor(message) -> str:
+    return encode_cursor({"created_at": message.created_at.isoformat(), "id": message.id})
+
+
+def decode_message_cursor(cursor: str) -> tuple[datetime, str]:
+    values = decode_cursor(cursor)
+    try:
+        return datetime.fromisoformat(values["created_at"]), str(values["id"])
+    except (KeyError, TypeError, ValueError):
+        raise InvalidCursorError("Invalid cursor")
@@ -0,0 +1,76 @@
+import asyncio
+import random
+import time
+import httpx
+from metrics import REQUEST_ID_HEADER, UPSTREAM_SECONDS, UPSTREAM_RETRIED, request_id, observe
+from config import (
+    AUTH_TIMEOUT,
+    AUTH_MAX_CONNECTIONS,
+    AGENT_TIMEOUT,
+    AGENT_MAX_CONNECTIONS,
+    UPSTREAM_CONNECT_TIMEOUT,
+    UPSTREAM_RETRIES,
+    UPSTREAM_RETRY_BACKOFF,
+)
+
+# statuses that mean the upstream did not handle the request and it can be sent again.
+# a 504 may come after the work was done, so it is only retried for idempotent requests
+RETRY_STATUSES = {502, 503, 504}
+UNHANDLED_STATUSES = {502, 503}
+
+
+def create_client(timeout: float, max_connections: int) -> httpx.AsyncClient:
+    # one pooled client per upstream, connections are kept alive between requests
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(timeout, connect=UPSTREAM_CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+    )
+
+
+auth_client = None
+agent_client = None
+
+
+async def start():
+    global auth_client, agent_client
+    auth_client = create_client(AUTH_TIMEOUT, AUTH_MAX_CONNECTIONS)
+    agent_client = create_client(AGENT_TIMEOUT, AGENT_MAX_CONNECTIONS)
+
+
+async def stop():
+    await auth_client.aclose()
+    await agent_client.aclose()
+
+
+async def send(
+    client: httpx.AsyncClient, method: str, url: str, idempotent: bool = True, stream: bool = False, **kwargs
+) -> httpx.Response:
+    # retries with exponential backoff and full jitter. a request that may have reached the upstream
+    # (read timeout, dropped connection) is only sent again when it is idempotent; one that never left
+    # (connect error) or that the upstream refused without handling it (502/503) always is.
+    retry_statuses = RETRY_STATUSES if idempotent else UNHANDLED_STATUSES
+    upstream = "auth" if client is auth_client else "agent"
+    # the upstream logs and echoes the id of the request that caused this one
+    if request_id.get() is not None:
+        kwargs["headers"] = {**kwargs.get("headers", {}), REQUEST_ID_HEADER: request_id.get()}
+    for attempt in range(UPSTREAM_RETRIES + 1):
+        last_attempt = attempt == UPSTREAM_RETRIES
+        if attempt > 0:
+            UPSTREAM_RETRIED.labels(upstream).inc()
+        started = time.perf_counter()
+        try:
+            # a streamed response must be closed by the caller, its time is up to the response headers
+            response = await client.send(client.build_request(method, url, **kwargs), stream=stream)
+            observe(UPSTREAM_SECONDS.labels(upstream, str(response.status_code)), time.perf_counter() - started)
+            if response.status_code not in retry_statuses or last_attempt:
+                return response
+            await response.aclose()
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout):
+            observe(UPSTREAM_SECONDS.labels(upstream, "error"), time.perf_counter() - started)
+            if last_attempt:
+                raise
+        except httpx.TransportError:
+            observe(UPSTREAM_SECONDS.labels(upstream, "error"), time.perf_counter() - started)
+            if last_attempt or not idempotent:
+                raise
+        await asyncio.sleep(random.uniform(0, UPSTREAM_RETRY_BACKOFF * 2 ** attempt))
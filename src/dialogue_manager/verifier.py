@@ -0,0 +1,45 @@
+import asyncio
+import time
+import ujson as json
+import services
+from jose import jwt
+
+# only asymmetric algorithms, a token can never pick a shared secret verification through its header
+ALGORITHMS = ["RS256"]
+
+
+class TokenVerifier:
+    # verifies access tokens against the public keys the auth service publishes, so a request
+    # is authorized without calling /me. keys are fetched once and kept; a token signed with an
+    # unknown kid (the auth service rotated its key) triggers a refetch, at most once per refresh_interval.
+    def __init__(self, jwks_url: str, refresh_interval: float):
+        self.jwks_url = jwks_url
+        self.refresh_interval = refresh_interval
+        self.keys = {}
+        self.fetched_at = None
+        self._lock = asyncio.Lock()
+
+    async def refresh(self):
+        async with self._lock:
+            if self.fetched_at is not None and time.monotonic() - self.fetched_at < self.refresh_interval:
+                return
+            response = await services.send(services.auth_client, "GET", self.jwks_url)
+            if response.status_code != 200:
+                return
+            self.keys = {key["kid"]: key for key in json.loads(response.content)["keys"] if "kid" in key}
+            # until the first successful fetch every unknown kid tries again
+            self.fetched_at = time.monotonic()
+
+    async def verify(self, token: str) -> dict | None:
+        # returns the verified claims, or None when the token is not one this verifier can check
+        # (signed with the shared secret). raises jwt.JWTError for a bad or expired token.
+        header = jwt.get_unverified_header(token)
+        kid = header.get("kid")
+        if kid is None or header.get("alg") not in ALGORITHMS:
+            return None
+        if kid not in self.keys:
+            await self.refresh()
+        key = self.keys.get(kid)
+        if key is None:
+            raise jwt.JWTError("Unknown signing key")
+        return jwt.decode(token, key, algorithms=ALGORITHMS)
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import time
+from typing import Callable
+from crud import create_messages, update_dialogue_heads
+from schemas import SchemaMessage
+from metrics import WRITER_FLUSH_SECONDS, WRITER_BATCH_PAIRS
+
+logger = logging.getLogger("uvicorn.error")
+
+# a turn is acknowledged once its messages are committed, or as soon as they are queued
+DURABILITY_MODES = {"commit", "enqueue"}
+
+
+class MessageWriter:
+    # write-behind persistence of turns. every turn is a (human, CHATBOT) pair that is written
+    # atomically; pairs queued by concurrent requests are grouped into one multi-row INSERT and
+    # a single commit. the queue is bounded, a full queue makes new turns wait for the writer.
+    def __init__(
+        self,
+        session_factory,
+        durability: str,
+        max_batch: int,
+        max_pending: int,
+        linger: float,
+        heads: bool = False,
+        on_failure: Callable[[list[SchemaMessage]], None] | None = None,
+    ):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode {durability}")
+        self.session_factory = session_factory
+        self.durability = durability
+        self.max_batch = max_batch
+        self.linger = linger
+        self.heads = heads
+        # called with the messages of every turn that could not be stored
+        self.on_failure = on_failure
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.batches = 0
+        self.pairs = 0
+        self.failed_pairs = 0
+        self.largest_batch = 0
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # everything queued before shutdown is flushed
+        await self.queue.join()
+        self._task.cancel()
+
+    async def write(self, messages: list[SchemaMessage]):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((messages, future))
+        if self.durability == "commit":
+            await future
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            if self.linger > 0:
+                await asyncio.sleep(self.linger)
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _flush(self, batch: list):
+        started = time.perf_counter()
+        try:
+            await self._insert([message for messages, _ in batch for message in messages])
+            results = [None] * len(batch)
+        except Exception:
+            # one bad pair must not fail the others, they are written one by one instead
+            results = []
+            for messages, _ in batch:
+                try:
+                    await self._insert(messages)
+                    results.append(None)
+                except Exception as e:
+                    results.append(e)
+
+        WRITER_FLUSH_SECONDS.observe(time.perf_counter() - started)
+        WRITER_BATCH_PAIRS.observe(len(batch))
+        self.batches += 1
+        self.pairs += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        for (messages, future), error in zip(batch, results):
+            if error is not None:
+                self.failed_pairs += 1
+                if self.on_failure is not None:
+                    self.on_failure(messages)
+                if self.durability == "enqueue":
+                    # the request already returned, nobody waits for this turn anymore
+                    logger.error("Could not store turn %s: %s", messages[0].id, error)
+            # a request cancelled while waiting leaves a cancelled future behind
+            if future.done() or self.durability == "enqueue":
+                continue
+            if error is None:
+                future.set_result(None)
+            else:
+                future.set_exception(error)
+
+    async def _insert(self, messages: list[SchemaMessage]):
+        async with self.session_factory() as db:
+            await create_messages(db=db, messages=messages)
+            if self.heads:
+                await update_dialogue_heads(db=db, messages=messages)
+            await db.commit()
+
+    def stats(self) -> dict:
+        return {
+            "durability": self.durability,
+            "pending": self.queue.qsize(),
+            "max_pending": self.queue.maxsize,
+            "batches": self.batches,
+            "pairs": self.pairs,
+            "failed_pairs": self.failed_pairs,
+            "largest_batch": self.largest_batch,
+        }